@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.routers import users_router, threads_router, messages_router
+from app.routers import users_router, threads_router, messages_router, presets_router, ws_router
 
 api_router = APIRouter()
 
@@ -7,6 +7,8 @@ api_router = APIRouter()
 api_router.include_router(users_router)
 api_router.include_router(threads_router)
 api_router.include_router(messages_router)
+api_router.include_router(presets_router)
+api_router.include_router(ws_router)
 
 # 新しいルーターを追加する場合、ここに追加します
 # api_router.include_router(items_router)
@@ -0,0 +1,152 @@
+"""
+WebSocket接続を管理するモジュール（ハートビートと送信のバックプレッシャー）
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from fastapi import WebSocket
+
+# ハートビート（ping）を送信する間隔（秒）
+HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("WS_HEARTBEAT_INTERVAL_SECONDS", "30"))
+# この秒数の間なにも受信しなかった接続は切断する
+HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv("WS_HEARTBEAT_TIMEOUT_SECONDS", "90"))
+# 1フレームの送信にこの秒数以上かかる（受信が追いつかない）クライアントは切断する
+SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+# 1ワーカーあたりの最大接続数
+MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "50000"))
+
+# 切断時のクローズコード
+CLOSE_GOING_AWAY = 1001
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def encode_frame(frame: List[Any]) -> str:
+    """フレームを区切り文字の空白を省いたJSON配列に変換します"""
+    return json.dumps(frame, ensure_ascii=False, separators=(",", ":"))
+
+
+class ChatConnection:
+    """
+    1本のWebSocket接続の状態
+
+    アイドル状態の接続を大量に保持できるよう、接続ごとのタスクは受信ループのみとし、
+    ハートビートはConnectionManagerがまとめて送信します。
+    """
+
+    __slots__ = ("websocket", "user", "thread_id", "last_received", "send_lock", "closed", "generation", "stream")
+
+    def __init__(self, websocket: WebSocket, user: Dict[str, Any], thread_id: int):
+        self.websocket = websocket
+        self.user = user
+        self.thread_id = thread_id
+        self.last_received = time.monotonic()
+        self.send_lock = asyncio.Lock()
+        self.closed = False
+        # 生成中のアシスタントメッセージを中継するタスク
+        self.generation: Optional[asyncio.Task] = None
+        # 中継しているストリーム（ActiveStream）
+        self.stream = None
+
+    def touch(self) -> None:
+        """フレームを受信したことを記録します"""
+        self.last_received = time.monotonic()
+
+    async def is_disconnected(self) -> bool:
+        return self.closed
+
+    async def send(self, frame: List[Any]) -> bool:
+        """
+        フレームを送信します
+
+        送信は1本ずつ順番に行い、送信が終わるまで待つことで、上流の生成処理に
+        バックプレッシャーをかけます。送信がタイムアウトした場合は接続を閉じます。
+
+        Returns:
+            bool: 送信できた場合はTrue
+        """
+        if self.closed:
+            return False
+        async with self.send_lock:
+            try:
+                await asyncio.wait_for(self.websocket.send_text(encode_frame(frame)), SEND_TIMEOUT_SECONDS)
+                return True
+            except asyncio.TimeoutError:
+                print(f"送信がタイムアウトしたため接続を閉じます: thread_id={self.thread_id}")
+                await self.close(CLOSE_TRY_AGAIN_LATER)
+            except Exception:
+                self.closed = True
+        return False
+
+    async def close(self, code: int) -> None:
+        """接続を閉じます"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+class ConnectionManager:
+    """
+    WebSocket接続の一覧を保持し、ハートビートの送信とタイムアウトした接続の切断を行います
+    """
+
+    def __init__(self, max_connections: int = MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self.connections: Set[ChatConnection] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, connection: ChatConnection) -> bool:
+        """
+        接続を登録します
+
+        Returns:
+            bool: 登録できた場合はTrue（上限に達している場合はFalse）
+        """
+        if len(self.connections) >= self.max_connections:
+            return False
+        self.connections.add(connection)
+        # 最初の接続でハートビートを開始する
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._heartbeat())
+        return True
+
+    def unregister(self, connection: ChatConnection) -> None:
+        self.connections.discard(connection)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+            now = time.monotonic()
+            ping = ["p", int(time.time() * 1000)]
+            targets = []
+            for connection in list(self.connections):
+                generating = connection.generation is not None and not connection.generation.done()
+                # 生成中の接続は送信が止まればタイムアウトで切断されるため、受信の途絶だけでは切断しない
+                if not generating and now - connection.last_received >= HEARTBEAT_TIMEOUT_SECONDS:
+                    await connection.close(CLOSE_GOING_AWAY)
+                    self.unregister(connection)
+                elif not connection.send_lock.locked():
+                    # 送信中の接続にはpingを送らない（送信が進んでいれば生存している）
+                    targets.append(connection)
+            # 遅いクライアントが他の接続へのpingを遅らせないよう、まとめて送信する
+            await asyncio.gather(*(connection.send(ping) for connection in targets))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """接続数などの統計情報を返します"""
+        return {
+            "connections": len(self.connections),
+            "maxConnections": self.max_connections,
+            "generating": sum(
+                1 for c in self.connections if c.generation is not None and not c.generation.done()
+            )
+        }
+
+
+CONNECTIONS = ConnectionManager()
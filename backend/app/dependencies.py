@@ -8,6 +8,17 @@ USERS_DB = {
     "3": {"id": "default_user", "name": "User 3", "email": "user3@example.com", "role": "user"}
 }
 
+# フロントエンドのオリジン（CORSとWebSocket接続時のOriginの確認に使用）
+ALLOWED_ORIGINS = [
+    "http://localhost:5173",  # Viteのデフォルトポート
+    "http://127.0.0.1:5173",
+    "http://localhost:3000",  # Create React Appのデフォルトポート
+    "http://127.0.0.1:3000",
+    "http://localhost:8080",  # 他の一般的なフロントエンドポート
+    "http://127.0.0.1:8080",
+    # 必要に応じて追加
+]
+
 async def get_user_from_cookie(user_id: Optional[str] = Cookie(None)) -> Dict[str, Any]:
     """
     Cookieからユーザー情報を取得する依存関数
@@ -0,0 +1,234 @@
+"""
+アシスタント応答の生成とストリーミング配信を管理するモジュール
+"""
+import asyncio
+import os
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional, Protocol
+
+from fastapi import HTTPException
+from app.prompt_cache import get_preset_prefix, tokenize
+from data.message_checkpoints import CHECKPOINTS
+
+# 同時に実行できるストリーミング生成の上限
+MAX_ACTIVE_STREAMS = int(os.getenv("MAX_ACTIVE_STREAMS", "100"))
+
+# クライアント切断を確認する間隔（秒）
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+# 上流の生成処理とレスポンスの間に置くバッファのサイズ（チャンク数）
+STREAM_BUFFER_SIZE = 64
+
+# メッセージの状態
+STATUS_STREAMING = "streaming"
+STATUS_COMPLETED = "completed"
+STATUS_TRUNCATED = "truncated"
+
+
+def build_prompt(thread: Dict[str, Any], preset: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    スレッドの会話履歴から生成に使うプロンプトを組み立てます
+
+    プリセットから作成されたスレッドでは、プリセットのプレフィックスを
+    キャッシュから再利用し、会話履歴の部分だけをトークン化します。
+
+    Args:
+        thread: 対象のスレッド
+        preset: スレッドの元になったプリセット（ない場合はNone）
+
+    Returns:
+        List[str]: プロンプトのトークン列
+    """
+    tokens: List[str] = []
+    if preset is not None:
+        tokens.extend(get_preset_prefix(preset).tokens)
+
+    for message in thread["messages"]:
+        tokens.extend(tokenize(message["text"]))
+    return tokens
+
+
+class DisconnectSource(Protocol):
+    """
+    クライアントの切断を確認できるオブジェクト（HTTPのRequestやWebSocket接続）
+    """
+
+    async def is_disconnected(self) -> bool:
+        ...
+
+
+async def generate_reply(
+    text: str,
+    prompt: Optional[List[str]] = None,
+    duration: float = 10.0
+) -> AsyncGenerator[str, None]:
+    """
+    上流の生成処理（モック）: 文字列をduration秒かけて1文字ずつ返します
+
+    Args:
+        text: 生成する文字列
+        prompt: 生成に使うプロンプトのトークン列（モックでは長さのみ使用）
+        duration: 全文字を返し終えるまでの時間（秒）
+
+    Yields:
+        str: 生成された文字
+    """
+    if prompt is not None:
+        print(f"生成開始: プロンプトのトークン数={len(prompt)}")
+
+    chars_total = len(text)
+    delay_per_char = duration / chars_total if chars_total > 0 else 0
+
+    for i in range(chars_total):
+        yield text[i:i+1]
+        await asyncio.sleep(delay_per_char)
+
+
+class ActiveStream:
+    """
+    生成中のアシスタントメッセージ1件分の状態
+    """
+
+    def __init__(self, thread_id: int, message: Dict[str, Any], user_id: str):
+        self.thread_id = thread_id
+        self.message = message
+        self.user_id = user_id
+        self.buffer: asyncio.Queue = asyncio.Queue(maxsize=STREAM_BUFFER_SIZE)
+        self.producer: Optional[asyncio.Task] = None
+        # 生成の終了時に確定したメッセージを受け取る処理（リポジトリへの書き込みなど）
+        self.on_finish: Optional[Callable[[Dict[str, Any]], Any]] = None
+        self.finished = False
+
+    def cancel(self) -> None:
+        """上流の生成処理を停止し、未送信のバッファを破棄します"""
+        if self.producer is not None and not self.producer.done():
+            self.producer.cancel()
+        while not self.buffer.empty():
+            self.buffer.get_nowait()
+
+
+class StreamRegistry:
+    """
+    生成中のストリームを管理し、同時実行数（ストリームスロット）を制限します
+    """
+
+    def __init__(self, max_streams: int):
+        self.max_streams = max_streams
+        self.active: Dict[int, ActiveStream] = {}
+
+    def open(self, thread_id: int, message: Dict[str, Any], user_id: str) -> ActiveStream:
+        """
+        メッセージ用のストリームスロットを確保します
+
+        Args:
+            thread_id: メッセージが属するスレッドのID
+            message: 生成するアシスタントメッセージ
+            user_id: 生成を要求したユーザーのID
+
+        Raises:
+            HTTPException: 空きスロットがない場合は503エラー
+        """
+        if len(self.active) >= self.max_streams:
+            raise HTTPException(status_code=503, detail="Too many active streams")
+
+        stream = ActiveStream(thread_id, message, user_id)
+        self.active[message["id"]] = stream
+        return stream
+
+    def release(self, message_id: int) -> None:
+        """ストリームスロットを解放し、生成処理とバッファを片付けます"""
+        stream = self.active.pop(message_id, None)
+        if stream is not None:
+            stream.cancel()
+
+
+STREAMS = StreamRegistry(MAX_ACTIVE_STREAMS)
+
+
+def finish_stream(stream: ActiveStream, completed: bool = False) -> bool:
+    """
+    ストリームスロットを解放し、メッセージの状態を確定させます
+
+    stream_reply が開始される前にキャンセルされた場合も、この関数でスロットを解放できます。
+    2回目以降の呼び出しは何もしません。
+
+    Args:
+        stream: 確定させるストリーム
+        completed: 上流の生成が最後まで終わった場合はTrue
+
+    Returns:
+        bool: この呼び出しで確定させた場合はTrue
+    """
+    if stream.finished:
+        return False
+    stream.finished = True
+
+    message = stream.message
+    message["status"] = STATUS_COMPLETED if completed else STATUS_TRUNCATED
+    STREAMS.release(message["id"])
+    CHECKPOINTS.finish(message["id"], message["status"])
+    if stream.on_finish is not None:
+        stream.on_finish(message)
+    print(f"ストリーミング終了: message_id={message['id']}, status={message['status']}, 文字数={len(message['text'])}")
+    return True
+
+
+async def _produce(stream: ActiveStream, source: AsyncGenerator[str, None]) -> None:
+    """上流から受け取ったチャンクをメッセージに反映し、バッファに積みます"""
+    try:
+        async for chunk in source:
+            stream.message["text"] += chunk
+            CHECKPOINTS.update(stream.message["id"])
+            await stream.buffer.put(chunk)
+        await stream.buffer.put(None)
+    finally:
+        # キャンセルされた場合も上流のジェネレータを確実に閉じる
+        await source.aclose()
+
+
+async def stream_reply(
+    client: DisconnectSource,
+    stream: ActiveStream,
+    source: AsyncGenerator[str, None]
+) -> AsyncIterator[str]:
+    """
+    上流の生成結果をクライアントへ中継します
+
+    クライアントの切断を検知した場合は上流の生成をキャンセルし、
+    途中までのメッセージを"truncated"として確定させます。
+
+    Args:
+        client: クライアントのリクエストまたは接続（切断検知に使用）
+        stream: StreamRegistryで確保したストリーム
+        source: 上流の生成処理
+
+    Yields:
+        str: クライアントへ送信するチャンク
+    """
+    message = stream.message
+    CHECKPOINTS.begin(stream.thread_id, message, stream.user_id)
+    stream.producer = asyncio.create_task(_produce(stream, source))
+    completed = False
+
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(stream.buffer.get(), DISCONNECT_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                # チャンクが届かない間も定期的に切断を確認する
+                if await client.is_disconnected():
+                    break
+                # 上流がエラーで停止した場合
+                if stream.producer.done() and stream.buffer.empty():
+                    break
+                continue
+
+            if chunk is None:
+                completed = True
+                break
+
+            if await client.is_disconnected():
+                break
+
+            yield chunk
+    finally:
+        finish_stream(stream, completed)
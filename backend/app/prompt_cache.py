@@ -0,0 +1,112 @@
+"""
+プリセットのプロンプトプレフィックスをキャッシュするモジュール
+"""
+import os
+import re
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+# キャッシュするプレフィックスの最大件数
+PREFIX_CACHE_SIZE = int(os.getenv("PREFIX_CACHE_SIZE", "32"))
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    文字列をトークンに分割します（モデル側のトークナイザーの代わり）
+
+    Args:
+        text: 分割する文字列
+
+    Returns:
+        List[str]: トークンのリスト
+    """
+    return _TOKEN_PATTERN.findall(text)
+
+
+class PromptPrefix:
+    """
+    複数のスレッドで共有されるプロンプトの先頭部分
+    """
+
+    def __init__(self, text: str, tokens: List[str], backend_state: Optional[Any] = None):
+        self.text = text
+        self.tokens = tokens
+        # 生成バックエンドがプレフィックスに対して保持する状態（KVキャッシュなど）
+        self.backend_state = backend_state
+
+
+class PrefixCache:
+    """
+    プロンプトプレフィックスのLRUキャッシュ
+
+    プリセットごとにプレフィックスを1度だけ構築し、そのプリセットから作成された
+    すべてのスレッドで再利用します。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Hashable, PromptPrefix]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, build: Callable[[], PromptPrefix]) -> PromptPrefix:
+        """
+        キャッシュからプレフィックスを取得します。なければ構築してキャッシュします
+
+        Args:
+            key: プレフィックスを識別するキー
+            build: キャッシュにない場合にプレフィックスを構築する関数
+
+        Returns:
+            PromptPrefix: プロンプトプレフィックス
+        """
+        prefix = self.entries.get(key)
+        if prefix is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return prefix
+
+        self.misses += 1
+        prefix = build()
+        self.entries[key] = prefix
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return prefix
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ヒット率などの統計情報を返します"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "maxEntries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": self.hits / lookups if lookups else 0.0
+        }
+
+
+PREFIX_CACHE = PrefixCache(PREFIX_CACHE_SIZE)
+
+
+def get_preset_prefix(preset: Dict[str, Any]) -> PromptPrefix:
+    """
+    プリセットのプロンプトプレフィックスを取得します
+
+    プリセットが更新された場合は別のキーになるため、古いプレフィックスは再利用されません。
+
+    Args:
+        preset: プリセット
+
+    Returns:
+        PromptPrefix: プリセットのシステムプロンプトから構築したプレフィックス
+    """
+    def build() -> PromptPrefix:
+        text = preset["systemPrompt"]
+        return PromptPrefix(text, tokenize(text))
+
+    return PREFIX_CACHE.get((preset["id"], preset["updatedAt"]), build)
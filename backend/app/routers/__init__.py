@@ -1,5 +1,7 @@
 from app.routers.users import router as users_router
 from app.routers.threads import router as threads_router
 from app.routers.messages import router as messages_router
+from app.routers.presets import router as presets_router
+from app.routers.ws import router as ws_router
 
-__all__ = ["users_router", "threads_router", "messages_router"]
+__all__ = ["users_router", "threads_router", "messages_router", "presets_router", "ws_router"]
@@ -1,10 +1,13 @@
-from fastapi import APIRouter, HTTPException, Depends, Body
-from typing import List, Dict, Any, Literal, Optional
+from fastapi import APIRouter, HTTPException, Depends, Body, Request
+from typing import AsyncGenerator, List, Dict, Any, Literal, Optional, Tuple
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 import time
-import asyncio
 from fastapi.responses import StreamingResponse
 from app.dependencies import get_user_from_cookie
+from app.generation import STREAMS, STATUS_STREAMING, ActiveStream, build_prompt, generate_reply, stream_reply
+from data.message_checkpoints import CHECKPOINTS
+from data.thread_deletion import DELETIONS
 from pydantic import BaseModel
 
 router = APIRouter(
@@ -13,13 +16,153 @@ router = APIRouter(
 )
 
 # threads.pyのモックデータを参照するため、importする
-from app.routers.threads import MOCK_THREADS, MAX_MESSAGE_ID
+from app.routers.threads import REPOSITORY, find_thread, next_message_id, persist
+from app.routers.presets import find_preset
 
 # リクエストのモデル定義
 class MessageCreate(BaseModel):
     text: str
 
 
+async def add_message(thread_id: int, text: str, sender: str) -> Dict[str, Any]:
+    """
+    指定されたスレッドにメッセージを追加します
+    
+    Args:
+        thread_id: メッセージを追加するスレッドのID
+        text: メッセージの本文
+        sender: 送信者（user / assistant）
+        
+    Returns:
+        Dict: 作成されたメッセージ情報
+        
+    Raises:
+        HTTPException: スレッドが見つからない場合は404、非アクティブな場合は400エラー
+    """
+    # 指定されたIDのスレッドを検索（見つからない場合は404エラー）
+    thread = await find_thread(thread_id)
+    
+    # スレッドがアクティブでない場合はエラー
+    if not thread["isActive"]:
+        raise HTTPException(status_code=400, detail="Cannot add message to inactive thread")
+    
+    # 現在の時刻を取得（ミリ秒）
+    current_time = int(time.time() * 1000)
+    
+    new_message = {
+        "id": next_message_id(),
+        "text": text,
+        "sender": sender,
+        "timestamp": current_time
+    }
+    
+    # スレッドのメッセージリストに追加
+    thread["messages"].append(new_message)
+    
+    # スレッドの更新日時を更新
+    thread["updatedAt"] = current_time
+    
+    # リポジトリへ書き込む
+    await persist(REPOSITORY.append_message(thread_id, new_message))
+    
+    return new_message
+
+
+async def open_assistant_stream(
+    thread_id: int,
+    text: str,
+    user: Dict[str, Any]
+) -> Tuple[ActiveStream, AsyncGenerator[str, None]]:
+    """
+    指定されたスレッドに空のアシスタントメッセージを追加し、生成を開始する準備をします
+    
+    Args:
+        thread_id: メッセージを追加するスレッドのID
+        text: 生成する文字列（モック）
+        user: 認証されたユーザー情報
+        
+    Returns:
+        Tuple: 確保したストリームと、上流の生成処理
+        
+    Raises:
+        HTTPException: スレッドが見つからない場合は404、非アクティブな場合は400、
+            ストリームスロットに空きがない場合は503エラー
+    """
+    # 指定されたIDのスレッドを検索（見つからない場合は404エラー）
+    thread = await find_thread(thread_id)
+    
+    # スレッドがアクティブでない場合はエラー
+    if not thread["isActive"]:
+        print(f"スレッド {thread_id} は非アクティブです")
+        raise HTTPException(status_code=400, detail="Cannot add message to inactive thread")
+    
+    # 現在の時刻を取得（ミリ秒）
+    current_time = int(time.time() * 1000)
+    
+    # 新しいアシスタントメッセージを作成 (最初は空の状態で)
+    new_message = {
+        "id": next_message_id(),
+        "text": "",  # 空の状態で始める
+        "sender": "assistant",
+        "timestamp": current_time,
+        "status": STATUS_STREAMING
+    }
+    
+    # プロンプトを組み立てる（プリセットのプレフィックスはキャッシュを再利用）
+    preset = find_preset(thread["presetId"]) if thread.get("presetId") is not None else None
+    prompt = build_prompt(thread, preset)
+    
+    # ストリームスロットを確保（空きがない場合は503エラー）
+    stream = STREAMS.open(thread_id, new_message, user["id"])
+    
+    # 生成が終わった時点の本文と状態をリポジトリへ書き込む（生成中の内容はチェックポイントで保存）
+    def save_reply(message: Dict[str, Any]) -> None:
+        # 生成中に削除されたスレッドには書き込まない
+        if DELETIONS.is_deleted(thread_id):
+            return
+        try:
+            future = REPOSITORY.append_message(thread_id, message)
+        except RuntimeError as e:
+            # リポジトリが閉じている・書き込みを停止している場合
+            print(f"メッセージ {message['id']} をリポジトリへ書き込めませんでした: {e}")
+            return
+        future.add_done_callback(report_write_error)
+
+    def report_write_error(future: Future) -> None:
+        # ログへの書き込み・fsyncに失敗した場合（フラッシュ用スレッドから呼ばれる）
+        if future.exception() is not None:
+            print(f"メッセージ {new_message['id']} のリポジトリへの書き込みに失敗しました: {future.exception()}")
+    
+    stream.on_finish = save_reply
+    
+    print(f"新しいメッセージID: {new_message['id']}")
+    
+    # スレッドのメッセージリストに追加
+    thread["messages"].append(new_message)
+    
+    # スレッドの更新日時を更新
+    thread["updatedAt"] = current_time
+    
+    # ログイン情報をログに出力（デバッグ用）
+    print(f"User {user['name']} (ID: {user['id']}) started streaming assistant message to thread {thread_id}")
+    
+    return stream, generate_reply(text, prompt)
+
+
+@router.get("/checkpoints/stats")
+async def get_checkpoint_stats(user: Dict[str, Any] = Depends(get_user_from_cookie)) -> Dict[str, Any]:
+    """
+    ログインユーザー専用: 生成中メッセージのチェックポイント書き込みの統計情報を取得します
+    
+    Args:
+        user: 認証されたユーザー情報（依存関数から取得）
+    
+    Returns:
+        Dict: 書き込み回数・応答数・チャンク数などの統計情報
+    """
+    return CHECKPOINTS.get_stats()
+
+
 @router.get("/{thread_id}")
 async def get_messages(
     thread_id: int, 
@@ -38,13 +181,8 @@ async def get_messages(
     # ログイン情報をログに出力（デバッグ用）
     print(f"User {user['name']} (ID: {user['id']}) accessed messages for thread {thread_id}")
     
-    # 指定されたIDのスレッドを検索
-    for thread in MOCK_THREADS:
-        if thread["id"] == thread_id:
-            return thread["messages"]
-    
-    # スレッドが見つからない場合は404エラー
-    raise HTTPException(status_code=404, detail="Thread not found")
+    # 指定されたIDのスレッドを検索（見つからない場合は404エラー）
+    return (await find_thread(thread_id))["messages"]
 
 
 @router.post("/{thread_id}", status_code=201)
@@ -64,41 +202,8 @@ async def create_message(
     Returns:
         Dict: 作成されたメッセージ情報
     """
-    global MAX_MESSAGE_ID
-    
-    # 指定されたIDのスレッドを検索
-    thread = None
-    for t in MOCK_THREADS:
-        if t["id"] == thread_id:
-            thread = t
-            break
-    
-    if thread is None:
-        raise HTTPException(status_code=404, detail="Thread not found")
-    
-    # スレッドがアクティブでない場合はエラー
-    if not thread["isActive"]:
-        raise HTTPException(status_code=400, detail="Cannot add message to inactive thread")
-    
-    # 現在の時刻を取得（ミリ秒）
-    current_time = int(time.time() * 1000)
-    
-    # IDをインクリメント
-    MAX_MESSAGE_ID += 1
-    
-    # 新しいメッセージを作成
-    new_message = {
-        "id": MAX_MESSAGE_ID,
-        "text": message_data.text,
-        "sender": "user",
-        "timestamp": current_time
-    }
-    
-    # スレッドのメッセージリストに追加
-    thread["messages"].append(new_message)
-    
-    # スレッドの更新日時を更新
-    thread["updatedAt"] = current_time
+    # 新しいメッセージを作成（スレッドがない場合は404、非アクティブな場合は400エラー）
+    new_message = await add_message(thread_id, message_data.text, "user")
     
     # ログイン情報をログに出力（デバッグ用）
     print(f"User {user['name']} (ID: {user['id']}) added message to thread {thread_id}")
@@ -124,41 +229,8 @@ async def create_assistant_message(
     Returns:
         Dict: 作成されたメッセージ情報
     """
-    global MAX_MESSAGE_ID
-    
-    # 指定されたIDのスレッドを検索
-    thread = None
-    for t in MOCK_THREADS:
-        if t["id"] == thread_id:
-            thread = t
-            break
-    
-    if thread is None:
-        raise HTTPException(status_code=404, detail="Thread not found")
-    
-    # スレッドがアクティブでない場合はエラー
-    if not thread["isActive"]:
-        raise HTTPException(status_code=400, detail="Cannot add message to inactive thread")
-    
-    # 現在の時刻を取得（ミリ秒）
-    current_time = int(time.time() * 1000)
-    
-    # IDをインクリメント
-    MAX_MESSAGE_ID += 1
-    
-    # 新しいアシスタントメッセージを作成
-    new_message = {
-        "id": MAX_MESSAGE_ID,
-        "text": message_data.text,
-        "sender": "assistant",
-        "timestamp": current_time
-    }
-    
-    # スレッドのメッセージリストに追加
-    thread["messages"].append(new_message)
-    
-    # スレッドの更新日時を更新
-    thread["updatedAt"] = current_time
+    # 新しいアシスタントメッセージを作成（スレッドがない場合は404、非アクティブな場合は400エラー）
+    new_message = await add_message(thread_id, message_data.text, "assistant")
     
     # ログイン情報をログに出力（デバッグ用）
     print(f"User {user['name']} (ID: {user['id']}) added assistant message to thread {thread_id}")
@@ -169,93 +241,30 @@ async def create_assistant_message(
 async def create_assistant_message_stream(
     thread_id: int,
     message_data: MessageCreate,
+    request: Request,
     user: Dict[str, Any] = Depends(get_user_from_cookie)
 ):
     """
     ログインユーザー専用: 指定されたスレッドにアシスタントのメッセージをストリーミングで作成します
     メッセージの文字列を10秒間かけて少しずつ送信します
+    クライアントが切断した場合は生成を中止し、メッセージを"truncated"として確定させます
     
     Args:
         thread_id: メッセージを追加するスレッドのID
         message_data: 作成するメッセージのデータ
+        request: クライアントのリクエスト（切断検知に使用）
         user: 認証されたユーザー情報（依存関数から取得）
         
     Returns:
         StreamingResponse: 文字列を徐々に返すストリーミングレスポンス
     """
-    global MAX_MESSAGE_ID
-    
     print(f"ストリーミングリクエスト受信: thread_id={thread_id}, message={message_data.text}")
     
-    # 指定されたIDのスレッドを検索
-    thread = None
-    for t in MOCK_THREADS:
-        if t["id"] == thread_id:
-            thread = t
-            break
-    
-    if thread is None:
-        print(f"スレッド {thread_id} が見つかりません")
-        raise HTTPException(status_code=404, detail="Thread not found")
-    
-    # スレッドがアクティブでない場合はエラー
-    if not thread["isActive"]:
-        print(f"スレッド {thread_id} は非アクティブです")
-        raise HTTPException(status_code=400, detail="Cannot add message to inactive thread")
-    
-    # 現在の時刻を取得（ミリ秒）
-    current_time = int(time.time() * 1000)
-    
-    # IDをインクリメント
-    MAX_MESSAGE_ID += 1
-    print(f"新しいメッセージID: {MAX_MESSAGE_ID}")
-    
-    message_text = message_data.text
-    
-    # 新しいアシスタントメッセージを作成 (最初は空の状態で)
-    new_message = {
-        "id": MAX_MESSAGE_ID,
-        "text": "",  # 空の状態で始める
-        "sender": "assistant",
-        "timestamp": current_time
-    }
-    
-    # スレッドのメッセージリストに追加
-    thread["messages"].append(new_message)
-    
-    # スレッドの更新日時を更新
-    thread["updatedAt"] = current_time
-    
-    # ログイン情報をログに出力（デバッグ用）
-    print(f"User {user['name']} (ID: {user['id']}) started streaming assistant message to thread {thread_id}")
-    
-    async def message_generator():
-        """メッセージを少しずつ生成するジェネレータ関数"""
-        full_text = message_text
-        chars_total = len(full_text)
-        
-        print(f"ストリーミング開始: 全文字数={chars_total}, 予想時間=10秒")
-        
-        # 完全なメッセージを10秒かけて送信
-        delay_per_char = 10.0 / chars_total if chars_total > 0 else 0
-        
-        # 少しずつ文字を送信
-        for i in range(chars_total):
-            # スレッドのメッセージを更新
-            new_message["text"] = full_text[:i+1]
-            
-            # 現在の文字を送信
-            current_char = full_text[i:i+1]
-            print(f"文字送信: '{current_char}' ({i+1}/{chars_total})")
-            yield current_char
-            
-            # 次の文字までの待機時間
-            await asyncio.sleep(delay_per_char)
-        
-        print("ストリーミング完了")
+    # アシスタントメッセージを作成し、ストリームスロットを確保
+    stream, source = await open_assistant_stream(thread_id, message_data.text, user)
     
     print("StreamingResponseを返します")
     return StreamingResponse(
-        message_generator(),
+        stream_reply(request, stream, source),
         media_type="text/plain"
-    ) 
\ No newline at end of file
+    )
@@ -0,0 +1,160 @@
+from fastapi import APIRouter, HTTPException, Depends
+from typing import List, Dict, Any
+import time
+from app.dependencies import get_user_from_cookie
+from app.prompt_cache import PREFIX_CACHE
+
+router = APIRouter(
+    prefix="/presets",
+    tags=["presets"]
+)
+
+# 現在のUNIXタイムスタンプ（ミリ秒）
+CURRENT_TIME = int(time.time() * 1000)
+
+# プリセットのカタログ（メモリ上で保持）
+MOCK_PRESETS = [
+    {
+        "id": 1,
+        "name": "カスタマーサポート",
+        "description": "製品に関する問い合わせに対応するためのテンプレート",
+        "category": "support",
+        "tags": ["customer", "help"],
+        "systemPrompt": (
+            "あなたは丁寧で正確なカスタマーサポート担当者です。"
+            "お客様の質問の意図を確認し、製品の仕様・料金・返品ポリシーに基づいて回答してください。"
+            "わからないことは推測せず、担当部署への問い合わせ方法を案内してください。"
+        ),
+        "initialMessages": [
+            {
+                "text": "こんにちは。本日はどのようなご用件でしょうか？",
+                "sender": "assistant",
+                "order": 1,
+                "options": [
+                    {"text": "料金について質問があります", "nextMessageId": 2},
+                    {"text": "返品したい商品があります", "nextMessageId": 3}
+                ]
+            }
+        ],
+        "createdAt": CURRENT_TIME - 86400000,  # 1日前
+        "updatedAt": CURRENT_TIME - 86400000
+    },
+    {
+        "id": 2,
+        "name": "旅行プランナー",
+        "description": "旅行の計画を一緒に立てるためのテンプレート",
+        "category": "travel",
+        "tags": ["travel", "planning"],
+        "systemPrompt": (
+            "あなたは経験豊富な旅行プランナーです。"
+            "行き先・日数・予算・同行者を確認したうえで、移動時間を考慮した現実的な旅程を提案してください。"
+            "季節のイベントや混雑状況についても触れてください。"
+        ),
+        "initialMessages": [
+            {
+                "text": "旅行の計画をお手伝いします。行き先と日程は決まっていますか？",
+                "sender": "assistant",
+                "order": 1
+            }
+        ],
+        "createdAt": CURRENT_TIME - 172800000,  # 2日前
+        "updatedAt": CURRENT_TIME - 172800000
+    },
+    {
+        "id": 3,
+        "name": "コードレビュー",
+        "description": "Pythonコードのレビューを依頼するためのテンプレート",
+        "category": "programming",
+        "tags": ["python", "review"],
+        "systemPrompt": (
+            "あなたはPythonに精通したシニアエンジニアです。"
+            "提示されたコードの不具合・可読性・性能の問題を指摘し、修正例を示してください。"
+            "指摘は重要度の高い順に並べてください。"
+        ),
+        "initialMessages": [
+            {
+                "text": "レビューしてほしいコードを貼り付けてください。",
+                "sender": "assistant",
+                "order": 1
+            }
+        ],
+        "createdAt": CURRENT_TIME - 259200000,  # 3日前
+        "updatedAt": CURRENT_TIME - 259200000
+    }
+]
+
+
+# クライアントに返すプリセットの項目（systemPromptはサーバー内でのみ使用する）
+PUBLIC_PRESET_FIELDS = (
+    "id", "name", "description", "initialMessages", "category", "tags", "createdAt", "updatedAt"
+)
+
+
+def find_preset(preset_id: int) -> Dict[str, Any]:
+    """
+    指定されたIDのプリセットを検索します
+
+    Raises:
+        HTTPException: プリセットが見つからない場合は404エラー
+    """
+    for preset in MOCK_PRESETS:
+        if preset["id"] == preset_id:
+            return preset
+
+    raise HTTPException(status_code=404, detail="Preset not found")
+
+
+@router.get("")
+async def get_presets(user: Dict[str, Any] = Depends(get_user_from_cookie)) -> List[Dict[str, Any]]:
+    """
+    ログインユーザー専用: プリセットの一覧を取得します
+
+    Args:
+        user: 認証されたユーザー情報（依存関数から取得）
+
+    Returns:
+        List[Dict]: プリセットの一覧
+    """
+    return [
+        {
+            "id": preset["id"],
+            "name": preset["name"],
+            "description": preset["description"],
+            "category": preset["category"],
+            "tags": preset["tags"],
+            "createdAt": preset["createdAt"],
+            "updatedAt": preset["updatedAt"],
+            "initialMessagesCount": len(preset["initialMessages"])
+        }
+        for preset in MOCK_PRESETS
+    ]
+
+
+@router.get("/cache/stats")
+async def get_prefix_cache_stats(user: Dict[str, Any] = Depends(get_user_from_cookie)) -> Dict[str, Any]:
+    """
+    ログインユーザー専用: プロンプトプレフィックスキャッシュの統計情報を取得します
+
+    Args:
+        user: 認証されたユーザー情報（依存関数から取得）
+
+    Returns:
+        Dict: ヒット数・ミス数・ヒット率などの統計情報
+    """
+    return PREFIX_CACHE.get_stats()
+
+
+@router.get("/{preset_id}")
+async def get_preset(preset_id: int, user: Dict[str, Any] = Depends(get_user_from_cookie)) -> Dict[str, Any]:
+    """
+    ログインユーザー専用: 指定されたIDのプリセットを取得します
+
+    Args:
+        preset_id: プリセットID
+        user: 認証されたユーザー情報（依存関数から取得）
+
+    Returns:
+        Dict: プリセット情報（systemPromptは含まない）
+    """
+    preset = find_preset(preset_id)
+    return {field: preset[field] for field in PUBLIC_PRESET_FIELDS}
@@ -1,8 +1,16 @@
-from fastapi import APIRouter, HTTPException, Depends, Body
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Body, Response
 from typing import List, Dict, Any, Literal, Optional
 from datetime import datetime, timedelta
+import asyncio
 import time
 from app.dependencies import get_user_from_cookie
+from app.generation import STREAMS
+from app.prompt_cache import get_preset_prefix
+from app.routers.presets import find_preset
+from app.tiering import TIERING_COLD_DIR, ColdStore, ThreadTiering
+from data.message_checkpoints import CHECKPOINTS
+from data.repository import create_repository
+from data.thread_deletion import DELETIONS
 from pydantic import BaseModel
 
 router = APIRouter(
@@ -97,12 +105,159 @@ MOCK_THREADS = [
 MAX_THREAD_ID = 3
 MAX_MESSAGE_ID = 8
 
+# 非アクティブ・長期間未使用のスレッドをコールドストレージへ移動する
+TIERING = ThreadTiering(MOCK_THREADS, ColdStore(TIERING_COLD_DIR))
+
+# スレッド・メッセージの永続化（STORAGE_BACKENDで選択）
+REPOSITORY = create_repository()
+
 # リクエストのモデル定義
 class ThreadCreate(BaseModel):
     title: str
     first_message: str
 
 
+class ThreadUpdate(BaseModel):
+    title: Optional[str] = None
+    isActive: Optional[bool] = None
+
+
+def next_message_id() -> int:
+    """新しいメッセージIDを採番します"""
+    global MAX_MESSAGE_ID
+    MAX_MESSAGE_ID += 1
+    return MAX_MESSAGE_ID
+
+
+async def persist(*futures) -> None:
+    """リポジトリへの書き込みが永続化されるまで待ちます"""
+    await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+
+
+async def write_thread(thread: Dict[str, Any]) -> None:
+    """スレッドをメッセージとともにリポジトリへ書き込みます"""
+    await persist(
+        REPOSITORY.save_thread(thread),
+        *(REPOSITORY.append_message(thread["id"], message) for message in thread["messages"])
+    )
+
+
+async def find_thread(thread_id: int) -> Dict[str, Any]:
+    """
+    指定されたIDのスレッドを検索します
+    コールドストレージ・リポジトリにある場合はホットストアへ戻してから返します
+    
+    Raises:
+        HTTPException: スレッドが見つからない場合（削除済みを含む）は404エラー
+    """
+    # 削除済みのスレッドは、データの削除が終わる前でも見つからないものとして扱う
+    if DELETIONS.is_deleted(thread_id):
+        raise HTTPException(status_code=404, detail="Thread not found")
+    
+    for thread in MOCK_THREADS:
+        if thread["id"] == thread_id:
+            TIERING.touch(thread_id)
+            return thread
+    
+    thread = await TIERING.rehydrate(thread_id)
+    if thread is not None:
+        return thread
+    
+    # 書き込み待ちの確認とログからの読み込みはイベントループを止めないよう別スレッドで行う
+    thread = await asyncio.to_thread(REPOSITORY.load_thread, thread_id)
+    if thread is not None:
+        if DELETIONS.is_deleted(thread_id):
+            raise HTTPException(status_code=404, detail="Thread not found")
+        # 読み込み中に別のリクエストが読み込んだ場合はそちらを使う
+        for loaded in MOCK_THREADS:
+            if loaded["id"] == thread_id:
+                TIERING.touch(thread_id)
+                return loaded
+        MOCK_THREADS.append(thread)
+        TIERING.touch(thread_id)
+        return thread
+    
+    raise HTTPException(status_code=404, detail="Thread not found")
+
+
+async def start_repository() -> None:
+    """
+    リポジトリを開き、保存されているスレッドとIDが重複しないようにします
+    
+    リポジトリが空の場合はモックデータを書き込み、データがある場合は
+    モックデータを使わずにリポジトリのスレッドを必要に応じて読み込みます。
+    """
+    global MAX_THREAD_ID, MAX_MESSAGE_ID
+    
+    await asyncio.to_thread(REPOSITORY.open)
+    if not REPOSITORY.list_thread_summaries():
+        for thread in MOCK_THREADS:
+            await write_thread(thread)
+        return
+    
+    MOCK_THREADS.clear()
+    max_thread_id, max_message_id = REPOSITORY.max_ids()
+    MAX_THREAD_ID = max(MAX_THREAD_ID, max_thread_id)
+    MAX_MESSAGE_ID = max(MAX_MESSAGE_ID, max_message_id)
+
+
+async def stop_repository() -> None:
+    """書き込み待ちのデータを永続化してリポジトリを閉じます"""
+    await asyncio.to_thread(REPOSITORY.close)
+
+
+async def start_tiering() -> None:
+    """コールドストレージのインデックスを読み込み、定期的な移動を開始します"""
+    global MAX_THREAD_ID, MAX_MESSAGE_ID
+    
+    await TIERING.start()
+    
+    # コールドストレージに残っているスレッドとIDが重複しないようにする
+    MAX_THREAD_ID = max(MAX_THREAD_ID, TIERING.max_thread_id)
+    MAX_MESSAGE_ID = max(MAX_MESSAGE_ID, TIERING.max_message_id)
+
+
+async def remove_local_thread(thread_id: int) -> None:
+    """
+    削除済みのスレッドをメモリ上・コールドストレージ・リポジトリから削除します
+    
+    削除要求の処理中に実行し、再起動後に削除済みのスレッドが読み込まれないようにします。
+    """
+    MOCK_THREADS[:] = [t for t in MOCK_THREADS if t["id"] != thread_id]
+    await asyncio.to_thread(TIERING.forget, thread_id)
+    await persist(REPOSITORY.delete_thread(thread_id))
+
+
+async def purge_thread(thread_id: int) -> None:
+    """
+    削除済みのスレッドのテーブルのデータを削除します（バックグラウンドで実行）
+    
+    生成中のメッセージを中止し、書き込み待ちのチェックポイントを破棄したあと、
+    テーブルのメッセージをバッチで削除します。
+    """
+    # 生成中のメッセージを中止し、書き込み待ちのチェックポイントを破棄
+    for stream in list(STREAMS.active.values()):
+        if stream.thread_id == thread_id:
+            STREAMS.release(stream.message["id"])
+    CHECKPOINTS.discard_thread(thread_id)
+    await CHECKPOINTS.drain()
+    
+    # テーブルのメッセージを削除
+    await asyncio.to_thread(DELETIONS.delete_items, thread_id)
+
+
+async def resume_deletions() -> None:
+    """前回のプロセスで終わらなかったスレッドの削除を再開します（起動時にバックグラウンドで実行）"""
+    thread_ids = await asyncio.to_thread(DELETIONS.pending_thread_ids)
+    for thread_id in thread_ids:
+        if DELETIONS.is_deleted(thread_id):
+            continue
+        print(f"スレッド {thread_id} の削除を再開します")
+        DELETIONS.tombstone(thread_id)
+        await remove_local_thread(thread_id)
+        await purge_thread(thread_id)
+
+
 @router.get("")
 async def get_threads(user: Dict[str, Any] = Depends(get_user_from_cookie)) -> List[Dict[str, Any]]:
     """
@@ -117,7 +272,41 @@ async def get_threads(user: Dict[str, Any] = Depends(get_user_from_cookie)) -> L
     # ログイン情報をログに出力（デバッグ用）
     print(f"User {user['name']} (ID: {user['id']}) accessed threads list")
     
-    return MOCK_THREADS
+    # コールドストレージ・リポジトリのスレッドは概要のみを返す（削除済みのスレッドは除く）
+    # リポジトリの概要はすべてのスレッドをコピーするため、イベントループを止めないよう別スレッドで取得する
+    summaries = await asyncio.to_thread(REPOSITORY.list_thread_summaries)
+    threads = MOCK_THREADS + TIERING.cold_summaries()
+    loaded = {thread["id"] for thread in threads}
+    threads += [t for t in summaries if t["id"] not in loaded]
+    return [thread for thread in threads if not DELETIONS.is_deleted(thread["id"])]
+
+
+@router.get("/tiering/stats")
+async def get_tiering_stats(user: Dict[str, Any] = Depends(get_user_from_cookie)) -> Dict[str, Any]:
+    """
+    ログインユーザー専用: ホットストアとコールドストレージの統計情報を取得します
+    
+    Args:
+        user: 認証されたユーザー情報（依存関数から取得）
+    
+    Returns:
+        Dict: それぞれのスレッド数・移動回数などの統計情報
+    """
+    return TIERING.get_stats()
+
+
+@router.get("/storage/stats")
+async def get_storage_stats(user: Dict[str, Any] = Depends(get_user_from_cookie)) -> Dict[str, Any]:
+    """
+    ログインユーザー専用: スレッド・メッセージの永続化の統計情報を取得します
+    
+    Args:
+        user: 認証されたユーザー情報（依存関数から取得）
+    
+    Returns:
+        Dict: 書き込み回数・コミット回数・起動時の復旧時間などの統計情報
+    """
+    return REPOSITORY.get_stats()
 
 
 @router.post("", status_code=201)
@@ -135,14 +324,13 @@ async def create_thread(
     Returns:
         Dict: 作成されたスレッド情報
     """
-    global MAX_THREAD_ID, MAX_MESSAGE_ID, MOCK_THREADS
+    global MAX_THREAD_ID, MOCK_THREADS
     
     # 現在の時刻を取得（ミリ秒）
     current_time = int(time.time() * 1000)
     
     # IDをインクリメント
     MAX_THREAD_ID += 1
-    MAX_MESSAGE_ID += 1
     
     # 新しいスレッドを作成
     new_thread = {
@@ -150,7 +338,7 @@ async def create_thread(
         "title": thread_data.title,
         "messages": [
             {
-                "id": MAX_MESSAGE_ID,
+                "id": next_message_id(),
                 "text": thread_data.first_message,
                 "sender": "user",
                 "timestamp": current_time
@@ -161,11 +349,71 @@ async def create_thread(
         "isActive": True
     }
     
-    # モックデータに追加
+    # ホットストアに追加し、リポジトリへ書き込む
     MOCK_THREADS.append(new_thread)
+    await write_thread(new_thread)
     
     # ログイン情報をログに出力（デバッグ用）
-    print(f"User {user['name']} (ID: {user['id']}) created new thread {MAX_THREAD_ID}: {thread_data.title}")
+    print(f"User {user['name']} (ID: {user['id']}) created new thread {new_thread['id']}: {thread_data.title}")
+    
+    return new_thread
+
+
+@router.post("/create-from-preset/{preset_id}", status_code=201)
+async def create_thread_from_preset(
+    preset_id: int,
+    user: Dict[str, Any] = Depends(get_user_from_cookie)
+) -> Dict[str, Any]:
+    """
+    ログインユーザー専用: プリセットをテンプレートとして新しいスレッドを作成します
+    
+    Args:
+        preset_id: テンプレートにするプリセットのID
+        user: 認証されたユーザー情報（依存関数から取得）
+        
+    Returns:
+        Dict: 作成されたスレッド情報
+    """
+    global MAX_THREAD_ID, MOCK_THREADS
+    
+    preset = find_preset(preset_id)
+    
+    # プリセットのプロンプトプレフィックスを事前に構築（作成済みならキャッシュを再利用）
+    get_preset_prefix(preset)
+    
+    # 現在の時刻を取得（ミリ秒）
+    current_time = int(time.time() * 1000)
+    
+    # IDをインクリメント
+    MAX_THREAD_ID += 1
+    
+    # プリセットの初期メッセージをスレッドのメッセージとしてコピー
+    messages = []
+    for initial_message in sorted(preset["initialMessages"], key=lambda m: m.get("order", 0)):
+        messages.append({
+            "id": next_message_id(),
+            "text": initial_message["text"],
+            "sender": initial_message["sender"],
+            "timestamp": current_time
+        })
+    
+    # 新しいスレッドを作成
+    new_thread = {
+        "id": MAX_THREAD_ID,
+        "title": preset["name"],
+        "messages": messages,
+        "createdAt": current_time,
+        "updatedAt": current_time,
+        "isActive": True,
+        "presetId": preset_id
+    }
+    
+    # ホットストアに追加し、リポジトリへ書き込む
+    MOCK_THREADS.append(new_thread)
+    await write_thread(new_thread)
+    
+    # ログイン情報をログに出力（デバッグ用）
+    print(f"User {user['name']} (ID: {user['id']}) created new thread {new_thread['id']} from preset {preset_id}")
     
     return new_thread
 
@@ -185,10 +433,97 @@ async def get_thread(thread_id: int, user: Dict[str, Any] = Depends(get_user_fro
     # ログイン情報をログに出力（デバッグ用）
     print(f"User {user['name']} (ID: {user['id']}) accessed thread {thread_id}")
     
-    # 指定されたIDのスレッドを検索
-    for thread in MOCK_THREADS:
-        if thread["id"] == thread_id:
-            return thread
+    # 指定されたIDのスレッドを検索（見つからない場合は404エラー）
+    return await find_thread(thread_id)
+
+
+@router.put("/{thread_id}")
+async def update_thread(
+    thread_id: int,
+    thread_data: ThreadUpdate,
+    user: Dict[str, Any] = Depends(get_user_from_cookie)
+) -> Dict[str, Any]:
+    """
+    ログインユーザー専用: 指定されたIDのスレッドのタイトル・アクティブ状態を更新します
+    
+    Args:
+        thread_id: スレッドID
+        thread_data: 更新する項目（指定されなかった項目は変更しない）
+        user: 認証されたユーザー情報（依存関数から取得）
+        
+    Returns:
+        Dict: 更新後のスレッド情報
+    """
+    # 指定されたIDのスレッドを検索（見つからない場合は404エラー）
+    thread = await find_thread(thread_id)
+    
+    if thread_data.title is not None:
+        thread["title"] = thread_data.title
+    if thread_data.isActive is not None:
+        thread["isActive"] = thread_data.isActive
+    
+    # スレッドの更新日時を更新
+    thread["updatedAt"] = int(time.time() * 1000)
+    await persist(REPOSITORY.save_thread(thread))
+    
+    # ログイン情報をログに出力（デバッグ用）
+    print(f"User {user['name']} (ID: {user['id']}) updated thread {thread_id}")
+    
+    return thread
+
+
+@router.delete("/{thread_id}", status_code=204)
+async def delete_thread(
+    thread_id: int,
+    background_tasks: BackgroundTasks,
+    user: Dict[str, Any] = Depends(get_user_from_cookie)
+) -> Response:
+    """
+    ログインユーザー専用: 指定されたIDのスレッドとそのメッセージを削除します
+    
+    スレッドはすぐに削除済みとして扱われ、以降の読み取りからは見えなくなります。
+    メッセージの削除はバックグラウンドで行い、進捗は GET /threads/{thread_id}/deletion で確認できます。
     
-    # スレッドが見つからない場合は404エラー
-    raise HTTPException(status_code=404, detail="Thread not found") 
\ No newline at end of file
+    Args:
+        thread_id: スレッドID
+        background_tasks: バックグラウンドで実行する処理
+        user: 認証されたユーザー情報（依存関数から取得）
+    """
+    # 存在しない・削除済みのスレッドは404エラー（コールドストレージにある場合も戻さずに確認する）
+    exists = (
+        TIERING.is_cold(thread_id)
+        or any(t["id"] == thread_id for t in MOCK_THREADS)
+        or REPOSITORY.has_thread(thread_id)
+    )
+    if not exists or DELETIONS.is_deleted(thread_id):
+        raise HTTPException(status_code=404, detail="Thread not found")
+    
+    # 削除要求をテーブルに記録し、ローカルのデータを削除してから応答する
+    # （テーブルのメッセージの削除中に再起動した場合も、スレッドが再び見えることはなく、削除は再開される）
+    DELETIONS.tombstone(thread_id)
+    await asyncio.to_thread(DELETIONS.record, thread_id)
+    await remove_local_thread(thread_id)
+    background_tasks.add_task(purge_thread, thread_id)
+    
+    # ログイン情報をログに出力（デバッグ用）
+    print(f"User {user['name']} (ID: {user['id']}) deleted thread {thread_id}")
+    
+    return Response(status_code=204)
+
+
+@router.get("/{thread_id}/deletion")
+async def get_thread_deletion(thread_id: int, user: Dict[str, Any] = Depends(get_user_from_cookie)) -> Dict[str, Any]:
+    """
+    ログインユーザー専用: 指定されたIDのスレッドの削除の進捗を取得します
+    
+    Args:
+        thread_id: スレッドID
+        user: 認証されたユーザー情報（依存関数から取得）
+        
+    Returns:
+        Dict: 削除の状態と削除済みのメッセージ件数など
+    """
+    progress = DELETIONS.get_progress(thread_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Deletion not found")
+    return progress
@@ -0,0 +1,173 @@
+from fastapi import APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from typing import Any, AsyncGenerator, Dict, List
+import asyncio
+import json
+from app.connections import (
+    CONNECTIONS, CLOSE_POLICY_VIOLATION, CLOSE_TRY_AGAIN_LATER, ChatConnection
+)
+from app.dependencies import ALLOWED_ORIGINS, get_user_from_cookie
+from app.generation import ActiveStream, finish_stream, stream_reply
+from app.routers.messages import add_message, open_assistant_stream
+from app.routers.threads import find_thread
+
+router = APIRouter(
+    prefix="/ws",
+    tags=["websocket"]
+)
+
+# フレームはJSON配列で、先頭の要素が種別を表します
+#
+# クライアント → サーバー
+#   ["m", seq, text]      ユーザーメッセージの送信
+#   ["g", seq, text]      アシスタントメッセージの生成（ストリーミング）
+#   ["x", seq]            生成中のアシスタントメッセージのキャンセル
+#   ["P", timestamp]      pingへの応答
+#
+# サーバー → クライアント
+#   ["a", seq, messageId, timestamp]   受付完了（ack）
+#   ["c", messageId, text]             アシスタントメッセージのチャンク
+#   ["e", messageId, status]           アシスタントメッセージの生成終了（completed / truncated）
+#   ["E", seq, statusCode, detail]     エラー
+#   ["p", timestamp]                   ping
+
+
+async def _relay(
+    connection: ChatConnection,
+    stream: ActiveStream,
+    source: AsyncGenerator[str, None]
+) -> None:
+    """生成されたチャンクを接続へ中継します"""
+    message = stream.message
+    chunks = stream_reply(connection, stream, source)
+    try:
+        async for chunk in chunks:
+            await connection.send(["c", message["id"], chunk])
+    finally:
+        # キャンセルされた場合も生成を確実に終了させてから終了を通知する
+        await chunks.aclose()
+        await connection.send(["e", message["id"], message["status"]])
+
+
+async def _cancel_generation(connection: ChatConnection) -> None:
+    """生成中のアシスタントメッセージをキャンセルします"""
+    task, stream = connection.generation, connection.stream
+    if task is None or task.done():
+        return
+    task.cancel()
+    if stream.producer is None:
+        # 最初のステップの前にキャンセルされた場合は_relayが実行されないため、ここで確定させて終了を通知する
+        finish_stream(stream)
+        await connection.send(["e", stream.message["id"], stream.message["status"]])
+    else:
+        # 上流の生成も止め、キャンセルが中継のタスクに届かなかった場合も中継を終わらせる
+        stream.cancel()
+
+
+async def _handle_frame(connection: ChatConnection, frame: List[Any]) -> None:
+    """受信したフレームを処理します"""
+    kind = frame[0]
+    seq = frame[1] if len(frame) > 1 else None
+
+    if kind == "P":
+        return
+
+    if kind == "m":
+        message = await add_message(connection.thread_id, str(frame[2]), "user")
+        await connection.send(["a", seq, message["id"], message["timestamp"]])
+        return
+
+    if kind == "g":
+        if connection.generation is not None and not connection.generation.done():
+            raise HTTPException(status_code=409, detail="Assistant message is already being generated")
+        stream, source = await open_assistant_stream(connection.thread_id, str(frame[2]), connection.user)
+        connection.stream = stream
+        connection.generation = asyncio.create_task(_relay(connection, stream, source))
+        # タスクが開始される前にキャンセルされてもストリームスロットを確実に解放する
+        connection.generation.add_done_callback(lambda _: finish_stream(stream))
+        await connection.send(["a", seq, stream.message["id"], stream.message["timestamp"]])
+        return
+
+    if kind == "x":
+        await _cancel_generation(connection)
+        return
+
+    raise HTTPException(status_code=400, detail="Unknown frame type")
+
+
+@router.websocket("/threads/{thread_id}")
+async def chat_socket(websocket: WebSocket, thread_id: int):
+    """
+    ログインユーザー専用: スレッドごとのチャット用WebSocket
+
+    接続時に1度だけCookieで認証し、以降はユーザーメッセージの送信、
+    アシスタントメッセージのチャンク、ackを1本の接続で送受信します。
+
+    Args:
+        websocket: WebSocket接続
+        thread_id: 対象のスレッドID
+    """
+    # CORSMiddlewareはWebSocketのハンドシェイクを対象にしないため、Originをここで確認する
+    # （他のサイトからCookieを使って接続されるのを防ぐ）
+    if websocket.headers.get("origin") not in ALLOWED_ORIGINS:
+        await websocket.close(code=CLOSE_POLICY_VIOLATION, reason="Origin not allowed")
+        return
+
+    # 接続時に1度だけ認証とスレッドの確認を行う
+    try:
+        user = await get_user_from_cookie(websocket.cookies.get("user_id"))
+        await find_thread(thread_id)
+    except HTTPException as e:
+        await websocket.close(code=CLOSE_POLICY_VIOLATION, reason=str(e.detail))
+        return
+
+    await websocket.accept()
+    connection = ChatConnection(websocket, user, thread_id)
+    if not CONNECTIONS.register(connection):
+        await connection.close(CLOSE_TRY_AGAIN_LATER)
+        return
+
+    print(f"User {user['name']} (ID: {user['id']}) connected to thread {thread_id}")
+
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            connection.touch()
+
+            try:
+                frame = json.loads(raw)
+                if not isinstance(frame, list) or not frame:
+                    raise ValueError
+            except ValueError:
+                await connection.send(["E", None, 400, "Invalid frame"])
+                continue
+
+            try:
+                await _handle_frame(connection, frame)
+            except HTTPException as e:
+                await connection.send(["E", frame[1] if len(frame) > 1 else None, e.status_code, e.detail])
+            except IndexError:
+                await connection.send(["E", frame[1] if len(frame) > 1 else None, 400, "Invalid frame"])
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: ハートビートのタイムアウトなどでサーバー側から閉じた場合
+        pass
+    finally:
+        # 切断された場合は生成を中止し、接続を解放する
+        connection.closed = True
+        CONNECTIONS.unregister(connection)
+        if connection.generation is not None:
+            connection.generation.cancel()
+        print(f"User {user['name']} (ID: {user['id']}) disconnected from thread {thread_id}")
+
+
+@router.get("/stats")
+async def get_socket_stats(user: Dict[str, Any] = Depends(get_user_from_cookie)) -> Dict[str, Any]:
+    """
+    ログインユーザー専用: WebSocket接続の統計情報を取得します
+
+    Args:
+        user: 認証されたユーザー情報（依存関数から取得）
+
+    Returns:
+        Dict: 接続数などの統計情報
+    """
+    return CONNECTIONS.get_stats()
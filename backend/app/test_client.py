@@ -1,6 +1,7 @@
 """
 Cookieベースの認証をテストするためのクライアント
 """
+import time
 import requests
 
 BASE_URL = "http://localhost:8000"
@@ -41,5 +42,39 @@ def test_cookie_auth():
     print(f"Response: {response.json()}")
 
 
+def test_stream_disconnect(thread_id: int = 1):
+    """
+    ストリーミング中にクライアントが切断した場合、サーバー側の生成が
+    一定時間内に停止し、メッセージが"truncated"で確定することを確認します
+    """
+    cookies = requests.get(f"{BASE_URL}/users/set-cookie").cookies
+
+    # ステップ1: ストリーミングを開始し、数チャンク受信したら切断
+    print("\n1. ストリーミング開始後に切断:")
+    response = requests.post(
+        f"{BASE_URL}/messages/{thread_id}/assistant/stream",
+        json={"text": "切断テスト用の長いメッセージです。" * 5},
+        cookies=cookies,
+        stream=True,
+    )
+    chunks = response.iter_content(chunk_size=None)
+    next(chunks)
+    response.close()
+
+    # ステップ2: 切断検知の間隔より長く待ってからメッセージを確認
+    time.sleep(1.5)
+    messages = requests.get(f"{BASE_URL}/messages/{thread_id}", cookies=cookies).json()
+    first = messages[-1]
+    print(f"status: {first.get('status')}, 文字数: {len(first['text'])}")
+
+    # ステップ3: さらに待っても本文が伸びていない（生成が止まっている）ことを確認
+    time.sleep(1.5)
+    messages = requests.get(f"{BASE_URL}/messages/{thread_id}", cookies=cookies).json()
+    second = messages[-1]
+    stopped = second["text"] == first["text"] and second.get("status") == "truncated"
+    print(f"生成停止: {'OK' if stopped else 'NG'}")
+
+
 if __name__ == "__main__":
-    test_cookie_auth() 
\ No newline at end of file
+    test_cookie_auth()
+    test_stream_disconnect() 
\ No newline at end of file
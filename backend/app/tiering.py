@@ -0,0 +1,312 @@
+"""
+非アクティブ・長期間未使用のスレッドをコールドストレージへ移動するモジュール
+"""
+import asyncio
+import json
+import os
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+from app.generation import STREAMS
+
+try:
+    import zstandard
+except ImportError:  # zstandardがない環境ではzlibで圧縮する
+    zstandard = None
+
+# コールドストレージのディレクトリ
+TIERING_COLD_DIR = os.getenv("TIERING_COLD_DIR", "cold_storage")
+# 最後の更新・アクセスからこの秒数が経過したスレッドを移動する
+TIERING_IDLE_SECONDS = float(os.getenv("TIERING_IDLE_SECONDS", str(7 * 24 * 3600)))
+# 非アクティブなスレッドは経過時間に関係なく移動する（直前にアクセスされたものを除く）
+TIERING_ARCHIVE_INACTIVE = os.getenv("TIERING_ARCHIVE_INACTIVE", "true").lower() == "true"
+# ホットストアに置くスレッドの合計サイズの上限（バイト、0は無制限）
+TIERING_MAX_HOT_BYTES = int(os.getenv("TIERING_MAX_HOT_BYTES", "0"))
+# 移動対象を確認する間隔（秒）
+TIERING_SWEEP_INTERVAL_SECONDS = float(os.getenv("TIERING_SWEEP_INTERVAL_SECONDS", "60"))
+
+
+def _compress(data: bytes) -> bytes:
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+
+def _decompress(data: bytes, suffix: str) -> bytes:
+    if suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read .zst blobs")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def thread_size(thread: Dict[str, Any]) -> int:
+    """スレッドのおおよそのサイズ（バイト）を返します"""
+    return 256 + sum(len(m["text"].encode("utf-8")) + 64 for m in thread["messages"])
+
+
+class ColdStore:
+    """
+    スレッドを圧縮したblobとしてローカルディレクトリに保存するコールドストレージ
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.suffix = ".zst" if zstandard is not None else ".zlib"
+
+    def _path(self, thread_id: int, suffix: str) -> str:
+        return os.path.join(self.directory, f"thread-{thread_id}.json{suffix}")
+
+    def _find(self, thread_id: int) -> Optional[str]:
+        for suffix in (".zst", ".zlib"):
+            path = self._path(thread_id, suffix)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def put(self, thread: Dict[str, Any]) -> int:
+        """
+        スレッドを圧縮して保存します
+
+        Returns:
+            int: 保存したblobのサイズ（バイト）
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        blob = _compress(json.dumps(thread, ensure_ascii=False).encode("utf-8"))
+        path = self._path(thread["id"], self.suffix)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(blob)
+        os.replace(tmp_path, path)
+        return len(blob)
+
+    def get(self, thread_id: int) -> Optional[Dict[str, Any]]:
+        """保存されたスレッドを読み込みます（存在しない場合はNone）"""
+        path = self._find(thread_id)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            data = _decompress(f.read(), os.path.splitext(path)[1])
+        return json.loads(data)
+
+    def delete(self, thread_id: int) -> None:
+        """保存されたスレッドを削除します"""
+        path = self._find(thread_id)
+        if path is not None:
+            os.remove(path)
+
+    def list_threads(self) -> List[Dict[str, Any]]:
+        """保存されているすべてのスレッドを読み込みます（起動時のインデックス再構築用）"""
+        if not os.path.isdir(self.directory):
+            return []
+        threads = []
+        for name in os.listdir(self.directory):
+            if name.startswith("thread-") and not name.endswith(".tmp"):
+                thread_id = int(name[len("thread-"):].split(".")[0])
+                thread = self.get(thread_id)
+                if thread is not None:
+                    threads.append(thread)
+        return threads
+
+
+class ThreadTiering:
+    """
+    ホットストア（メモリ上のスレッド一覧）とコールドストレージの間でスレッドを移動するクラス
+
+    ポリシーに合うスレッドをコールドストレージへ移してホットストアから解放し、
+    アクセスされた時点でホットストアへ戻します。コールドストレージにあるスレッドは
+    一覧表示用の概要だけをメモリ上に保持します。
+    """
+
+    def __init__(
+        self,
+        hot_threads: List[Dict[str, Any]],
+        cold_store: ColdStore,
+        idle_seconds: float = TIERING_IDLE_SECONDS,
+        archive_inactive: bool = TIERING_ARCHIVE_INACTIVE,
+        max_hot_bytes: int = TIERING_MAX_HOT_BYTES,
+        sweep_interval: float = TIERING_SWEEP_INTERVAL_SECONDS
+    ):
+        self.hot_threads = hot_threads
+        self.cold_store = cold_store
+        self.idle_seconds = idle_seconds
+        self.archive_inactive = archive_inactive
+        self.max_hot_bytes = max_hot_bytes
+        self.sweep_interval = sweep_interval
+        self.cold_index: Dict[int, Dict[str, Any]] = {}
+        # コールドストレージ内の最大ID（起動時のID採番の再開に使用）
+        self.max_thread_id = 0
+        self.max_message_id = 0
+        self.last_access: Dict[int, int] = {}
+        self.stats = {"archived": 0, "rehydrated": 0, "hotBytesFreed": 0, "coldBytesWritten": 0}
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _summary(thread: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": thread["id"],
+            "title": thread["title"],
+            "messages": [],
+            "messageCount": len(thread["messages"]),
+            "createdAt": thread["createdAt"],
+            "updatedAt": thread["updatedAt"],
+            "isActive": thread["isActive"],
+            "archived": True
+        }
+
+    def touch(self, thread_id: int) -> None:
+        """スレッドへのアクセスを記録します"""
+        self.last_access[thread_id] = int(time.time() * 1000)
+
+    def is_cold(self, thread_id: int) -> bool:
+        return thread_id in self.cold_index
+
+    def cold_summaries(self) -> List[Dict[str, Any]]:
+        """コールドストレージにあるスレッドの概要を返します"""
+        return list(self.cold_index.values())
+
+    async def rehydrate(self, thread_id: int) -> Optional[Dict[str, Any]]:
+        """
+        コールドストレージのスレッドをホットストアへ戻します
+
+        Returns:
+            Dict: 戻したスレッド（コールドストレージにない場合はNone）
+        """
+        if thread_id not in self.cold_index:
+            return None
+        thread = await asyncio.to_thread(self.cold_store.get, thread_id)
+
+        # 読み込み中に他のリクエストがホットストアへ戻した・削除した場合
+        if thread_id not in self.cold_index:
+            return next((t for t in self.hot_threads if t["id"] == thread_id), None)
+        if thread is None:
+            del self.cold_index[thread_id]
+            return None
+
+        self.hot_threads.append(thread)
+        del self.cold_index[thread_id]
+        self.touch(thread_id)
+        await asyncio.to_thread(self.cold_store.delete, thread_id)
+        self.stats["rehydrated"] += 1
+        print(f"スレッド {thread_id} をコールドストレージから戻しました")
+        return thread
+
+    def forget(self, thread_id: int) -> None:
+        """削除されたスレッドをコールドストレージとインデックスから取り除きます"""
+        self.cold_index.pop(thread_id, None)
+        self.last_access.pop(thread_id, None)
+        self.cold_store.delete(thread_id)
+
+    def _idle_ms(self, thread: Dict[str, Any], now: int) -> int:
+        last_used = max(thread["updatedAt"], self.last_access.get(thread["id"], 0))
+        return now - last_used
+
+    def select_candidates(self) -> List[Dict[str, Any]]:
+        """ポリシーに基づいてコールドストレージへ移すスレッドを選びます"""
+        now = int(time.time() * 1000)
+        streaming = {stream.thread_id for stream in STREAMS.active.values()}
+        threads = [t for t in self.hot_threads if t["id"] not in streaming]
+
+        selected = {}
+        for thread in threads:
+            if self.archive_inactive and not thread["isActive"]:
+                # 直前にアクセスされた非アクティブなスレッドは次の確認まで残す
+                if now - self.last_access.get(thread["id"], 0) >= self.sweep_interval * 1000:
+                    selected[thread["id"]] = thread
+            elif self._idle_ms(thread, now) >= self.idle_seconds * 1000:
+                selected[thread["id"]] = thread
+
+        # サイズ上限を超えている場合は、最も長く使われていないスレッドから移す
+        if self.max_hot_bytes > 0:
+            hot_bytes = sum(thread_size(t) for t in self.hot_threads if t["id"] not in selected)
+            for thread in sorted(threads, key=lambda t: self._idle_ms(t, now), reverse=True):
+                if hot_bytes <= self.max_hot_bytes:
+                    break
+                if thread["id"] not in selected:
+                    selected[thread["id"]] = thread
+                    hot_bytes -= thread_size(thread)
+
+        return list(selected.values())
+
+    async def archive(self, thread: Dict[str, Any]) -> bool:
+        """
+        スレッドをコールドストレージへ移し、ホットストアから解放します
+
+        Returns:
+            bool: 移動した場合はTrue（書き込み中に更新された場合はFalse）
+        """
+        updated_at = thread["updatedAt"]
+        message_count = len(thread["messages"])
+        snapshot = json.loads(json.dumps(thread))
+        written = await asyncio.to_thread(self.cold_store.put, snapshot)
+
+        # 書き込み中に更新・削除されたスレッドは移動しない
+        changed = thread["updatedAt"] != updated_at or len(thread["messages"]) != message_count
+        if changed or thread not in self.hot_threads:
+            await asyncio.to_thread(self.cold_store.delete, thread["id"])
+            return False
+
+        self.hot_threads.remove(thread)
+        self.cold_index[thread["id"]] = self._summary(thread)
+        self.last_access.pop(thread["id"], None)
+        self.stats["archived"] += 1
+        self.stats["hotBytesFreed"] += thread_size(thread)
+        self.stats["coldBytesWritten"] += written
+        print(f"スレッド {thread['id']} をコールドストレージへ移動しました ({written} bytes)")
+        return True
+
+    async def sweep(self) -> int:
+        """
+        ポリシーに合うスレッドをコールドストレージへ移します
+
+        Returns:
+            int: 移動したスレッドの件数
+        """
+        archived = 0
+        for thread in self.select_candidates():
+            if await self.archive(thread):
+                archived += 1
+        return archived
+
+    def load_index(self) -> None:
+        """コールドストレージの内容から概要のインデックスを再構築します"""
+        hot_threads = {t["id"]: t for t in self.hot_threads}
+        for thread in self.cold_store.list_threads():
+            hot = hot_threads.get(thread["id"])
+            if hot is not None:
+                # 起動直後のホットストアにあるのはモックデータのため、コールドストレージの内容を残す
+                # （モックデータのupdatedAtは起動時刻から計算されるため、更新日時では比較できない）
+                self.hot_threads.remove(hot)
+            self.cold_index[thread["id"]] = self._summary(thread)
+            self.max_thread_id = max(self.max_thread_id, thread["id"])
+            for message in thread["messages"]:
+                self.max_message_id = max(self.max_message_id, message["id"])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ホット・コールドそれぞれの件数や移動回数などの統計情報を返します"""
+        return {
+            **self.stats,
+            "hotThreads": len(self.hot_threads),
+            "coldThreads": len(self.cold_index),
+            "hotBytes": sum(thread_size(t) for t in self.hot_threads)
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"コールドストレージへの移動中にエラーが発生しました: {e}")
+
+    async def start(self) -> None:
+        """インデックスを読み込み、定期的な移動を開始します"""
+        await asyncio.to_thread(self.load_index)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """定期的な移動を停止します"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,143 @@
+"""
+追記型ログストレージ（STORAGE_BACKEND=log）のベンチマーク
+
+1. 複数のスレッドから同時にメッセージを追記し、スループットとグループコミットの効果を計測します
+2. 閉じて開き直し、スナップショット＋ログ末尾からの復旧時間と、ログ全体からの復旧時間を計測します
+3. ランダムに選んだスレッドの履歴をmmapしたセグメントから読み込む時間を計測します
+
+使い方:
+    python benchmarks/log_store.py [--messages 10000000] [--threads 100000] [--writers 8]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data.log_store import SNAPSHOT_FILE, LogThreadRepository  # noqa: E402
+
+
+def append_messages(repository: LogThreadRepository, args: argparse.Namespace) -> float:
+    """writers個のスレッドからメッセージを追記し、所要時間（秒）を返します"""
+    now = int(time.time() * 1000)
+    for thread_id in range(1, args.threads + 1):
+        repository.save_thread({
+            "id": thread_id,
+            "title": f"thread {thread_id}",
+            "createdAt": now,
+            "updatedAt": now,
+            "isActive": True
+        })
+
+    text = "あ" * (args.text_bytes // 3)
+    per_writer = args.messages // args.writers
+
+    def writer(index: int) -> None:
+        # 同時に処理中のリクエストがinflight件ある状態を再現する
+        inflight = deque()
+        for i in range(per_writer):
+            message_id = index * per_writer + i + 1
+            inflight.append(repository.append_message(message_id % args.threads + 1, {
+                "id": message_id,
+                "text": text,
+                "sender": "user" if i % 2 == 0 else "assistant",
+                "timestamp": now + message_id
+            }))
+            if len(inflight) >= args.inflight:
+                inflight.popleft().result()
+        for future in inflight:
+            future.result()
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started
+
+
+def anonymous_memory_mb() -> float:
+    """mmapしたセグメントを除くメモリ使用量（MB、Linuxのみ）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def reopen(directory: str, args: argparse.Namespace) -> LogThreadRepository:
+    repository = LogThreadRepository(directory, fsync=not args.no_fsync)
+    repository.open()
+    return repository
+
+
+def main():
+    parser = argparse.ArgumentParser(description="追記型ログストレージのベンチマーク")
+    parser.add_argument("--messages", type=int, default=10_000_000, help="追記するメッセージ数")
+    parser.add_argument("--threads", type=int, default=100_000, help="チャットスレッドの数")
+    parser.add_argument("--writers", type=int, default=8, help="同時に追記するスレッド（OSスレッド）の数")
+    parser.add_argument("--inflight", type=int, default=32, help="書き込みスレッドごとの未完了の書き込みの上限")
+    parser.add_argument("--text-bytes", type=int, default=150, help="メッセージ本文のおおよそのバイト数")
+    parser.add_argument("--reads", type=int, default=1000, help="履歴を読み込むスレッドの数")
+    parser.add_argument("--dir", default=None, help="データを書き込むディレクトリ（デフォルトは一時ディレクトリ）")
+    parser.add_argument("--no-fsync", action="store_true", help="コミット時にfsyncしない")
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix="log-store-bench-")
+    try:
+        # 1. 追記のスループット
+        repository = reopen(directory, args)
+        seconds = append_messages(repository, args)
+        stats = repository.get_stats()
+        total = args.messages // args.writers * args.writers
+        size = sum(
+            os.path.getsize(os.path.join(directory, name))
+            for name in os.listdir(directory) if name.endswith(".log")
+        )
+        print(f"追記: {total:,}件 / {seconds:.1f}秒 = {total / seconds:,.0f}件/秒, "
+              f"{size / seconds / 1024 / 1024:.1f}MB/秒 (fsync={'off' if args.no_fsync else 'on'})")
+        print(f"  コミット回数={stats['commits']:,}, 1コミットあたりのレコード数={stats['recordsPerCommit']}, "
+              f"セグメント数={stats['activeSegment']}, ログのサイズ={size / 1024 / 1024:,.0f}MB")
+
+        started = time.perf_counter()
+        repository.close()
+        print(f"  終了時のスナップショット作成: {time.perf_counter() - started:.2f}秒")
+
+        # 2. 復旧時間
+        started = time.perf_counter()
+        repository = reopen(directory, args)
+        print(f"復旧（スナップショット＋ログ末尾）: {time.perf_counter() - started:.2f}秒")
+        repository.close()
+
+        os.remove(os.path.join(directory, SNAPSHOT_FILE))
+        started = time.perf_counter()
+        repository = reopen(directory, args)
+        print(f"復旧（ログ全体の再生）: {time.perf_counter() - started:.2f}秒, "
+              f"再生したレコード数={repository.get_stats()['replayedRecords']:,}, "
+              f"メモリ使用量（mmapを除く）={anonymous_memory_mb():,.0f}MB")
+
+        # 3. 履歴の読み込み
+        thread_ids = random.sample(range(1, args.threads + 1), min(args.reads, args.threads))
+        started = time.perf_counter()
+        loaded = sum(len(repository.load_thread(thread_id)["messages"]) for thread_id in thread_ids)
+        seconds = time.perf_counter() - started
+        print(f"履歴の読み込み: {len(thread_ids):,}スレッド（平均{loaded / len(thread_ids):,.0f}件） / "
+              f"{seconds:.2f}秒 = 1スレッドあたり{seconds / len(thread_ids) * 1000:.2f}ms")
+        repository.close()
+    finally:
+        if args.dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
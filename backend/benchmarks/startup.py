@@ -0,0 +1,73 @@
+"""
+APIサーバーのコールドスタート時間を計測するベンチマーク
+
+新しいPythonプロセスで `main` のimportとlifespanの起動処理を実行し、
+それぞれの所要時間と、起動完了時点でboto3がimportされているかを表示します。
+
+使い方:
+    python benchmarks/startup.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子プロセスが計測結果の行の先頭に付ける文字列
+# （バックグラウンドのスレッドが結果の後にログを出力することがあるため、この行だけを読む）
+RESULT_PREFIX = "STARTUP_RESULT "
+
+# 計測用に子プロセスで実行するスクリプト
+CHILD_SCRIPT = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def run_lifespan():
+    async with main.app.router.lifespan_context(main.app):
+        return time.perf_counter()
+
+started = asyncio.run(run_lifespan())
+print(RESULT_PREFIX + json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "startup_ms": (started - imported) * 1000,
+    "boto3_loaded": "boto3" in sys.modules,
+}), flush=True)
+"""
+
+
+def measure(mode: str) -> dict:
+    """指定したSTARTUP_MODEで1回起動し、計測結果を返します"""
+    env = dict(os.environ, STARTUP_MODE=mode, PYTHONPATH=BACKEND_DIR)
+    result = subprocess.run(
+        [sys.executable, "-c", f"RESULT_PREFIX = {RESULT_PREFIX!r}\n" + CHILD_SCRIPT],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"計測結果が出力されませんでした: STARTUP_MODE={mode}\n{result.stdout}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="コールドスタート時間のベンチマーク")
+    parser.add_argument("--runs", type=int, default=5, help="モードごとの計測回数")
+    parser.add_argument("--modes", nargs="+", default=["lazy", "background", "eager"],
+                        help="計測するSTARTUP_MODE")
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'import(ms)':>12}{'startup(ms)':>13}{'total(ms)':>11}  boto3 loaded")
+    for mode in args.modes:
+        results = [measure(mode) for _ in range(args.runs)]
+        import_ms = statistics.median(r["import_ms"] for r in results)
+        startup_ms = statistics.median(r["startup_ms"] for r in results)
+        boto3_loaded = any(r["boto3_loaded"] for r in results)
+        print(f"{mode:<12}{import_ms:>12.1f}{startup_ms:>13.1f}{import_ms + startup_ms:>11.1f}  {boto3_loaded}")
+
+
+if __name__ == "__main__":
+    main()
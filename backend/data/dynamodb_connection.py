@@ -1,9 +1,42 @@
-import boto3
 import os
-from botocore.exceptions import ClientError
+import threading
+import time
+
+# 接続に失敗した後、再接続を試みるまでの秒数（その間はすぐにNoneを返す）
+DYNAMODB_RETRY_INTERVAL_SECONDS = float(os.getenv('DYNAMODB_RETRY_INTERVAL_SECONDS', '30'))
+
+# boto3/botocoreのimportには数百ミリ秒かかるため、初回の接続時までimportしない
+# 接続に成功したリソース・クライアントはプロセス内で使い回す
+_resource = None
+_client = None
+# 最後に接続に失敗した時刻（time.monotonic）
+_resource_failed_at = None
+_client_failed_at = None
+_lock = threading.Lock()
+
+
+def _retry_due(failed_at) -> bool:
+    """前回の接続の失敗から再接続を試みてよい時間が経ったかを返す関数"""
+    return failed_at is None or time.monotonic() - failed_at >= DYNAMODB_RETRY_INTERVAL_SECONDS
+
 
 def get_dynamodb_resource():
-    """DynamoDBリソースへの接続を取得する関数"""
+    """
+    DynamoDBリソースへの接続を取得する関数（2回目以降は接続済みのリソースを返す）
+    接続に失敗した場合は、DYNAMODB_RETRY_INTERVAL_SECONDSが経つまで再接続せずにNoneを返す
+    """
+    global _resource, _resource_failed_at
+    
+    with _lock:
+        if _resource is None and _retry_due(_resource_failed_at):
+            _resource = _connect_dynamodb_resource()
+            _resource_failed_at = time.monotonic() if _resource is None else None
+    return _resource
+
+
+def _connect_dynamodb_resource():
+    """DynamoDBリソースへ接続する関数"""
+    import boto3
     
     # 環境変数からDynamoDBの設定を取得
     is_local = os.getenv('IS_LOCAL', 'false').lower() == 'true'
@@ -55,8 +88,24 @@ def get_dynamodb_resource():
     
     return dynamodb
 
+
 def get_dynamodb_client():
-    """DynamoDBクライアントへの接続を取得する関数"""
+    """
+    DynamoDBクライアントへの接続を取得する関数（2回目以降は接続済みのクライアントを返す）
+    接続に失敗した場合は、DYNAMODB_RETRY_INTERVAL_SECONDSが経つまで再接続せずにNoneを返す
+    """
+    global _client, _client_failed_at
+    
+    with _lock:
+        if _client is None and _retry_due(_client_failed_at):
+            _client = _connect_dynamodb_client()
+            _client_failed_at = time.monotonic() if _client is None else None
+    return _client
+
+
+def _connect_dynamodb_client():
+    """DynamoDBクライアントへ接続する関数"""
+    import boto3
     
     # 環境変数からDynamoDBの設定を取得
     is_local = os.getenv('IS_LOCAL', 'false').lower() == 'true'
@@ -103,4 +152,10 @@ def get_dynamodb_client():
             print(f"DynamoDB接続エラー: {e}")
             return None
     
-    return client 
\ No newline at end of file
+    return client 
+
+
+def warm_up_dynamodb() -> None:
+    """boto3のimportとDynamoDBへの接続を事前に済ませる関数（バックグラウンドでの実行を想定）"""
+    if get_dynamodb_resource() is not None:
+        print("DynamoDBのウォームアップが完了しました")
@@ -39,6 +39,22 @@ def create_dynamodb_tables():
                 {
                     'AttributeName': 'user_id',
                     'AttributeType': 'S'
+                },
+                {
+                    'AttributeName': 'streaming_status',
+                    'AttributeType': 'S'
+                },
+                {
+                    'AttributeName': 'updated_at',
+                    'AttributeType': 'N'
+                },
+                {
+                    'AttributeName': 'deletion_status',
+                    'AttributeType': 'S'
+                },
+                {
+                    'AttributeName': 'deletion_requested_at',
+                    'AttributeType': 'N'
                 }
             ],
             'GlobalSecondaryIndexes': [
@@ -61,6 +77,48 @@ def create_dynamodb_tables():
                         'ReadCapacityUnits': 5,
                         'WriteCapacityUnits': 5
                     }
+                },
+                {
+                    # 生成中のメッセージのみを含むスパースインデックス（書きかけのメッセージの回復に使用）
+                    'IndexName': 'streaming-index',
+                    'KeySchema': [
+                        {
+                            'AttributeName': 'streaming_status',
+                            'KeyType': 'HASH'
+                        },
+                        {
+                            'AttributeName': 'updated_at',
+                            'KeyType': 'RANGE'
+                        }
+                    ],
+                    'Projection': {
+                        'ProjectionType': 'KEYS_ONLY'
+                    },
+                    'ProvisionedThroughput': {
+                        'ReadCapacityUnits': 5,
+                        'WriteCapacityUnits': 5
+                    }
+                },
+                {
+                    # 削除中のスレッドのメタデータアイテムのみを含むスパースインデックス（再起動時の削除の再開に使用）
+                    'IndexName': 'deletion-index',
+                    'KeySchema': [
+                        {
+                            'AttributeName': 'deletion_status',
+                            'KeyType': 'HASH'
+                        },
+                        {
+                            'AttributeName': 'deletion_requested_at',
+                            'KeyType': 'RANGE'
+                        }
+                    ],
+                    'Projection': {
+                        'ProjectionType': 'KEYS_ONLY'
+                    },
+                    'ProvisionedThroughput': {
+                        'ReadCapacityUnits': 5,
+                        'WriteCapacityUnits': 5
+                    }
                 }
             ],
             'ProvisionedThroughput': {
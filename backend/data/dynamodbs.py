@@ -1,8 +1,16 @@
+import argparse
 import os
 from data.dynamodb_connection import get_dynamodb_resource, get_dynamodb_client
 from data.dynamodb_tables import create_dynamodb_tables, list_tables
 
 # 後方互換性のためにエクスポート
 if __name__ == "__main__":
-    # create_dynamodb_tables()
+    # テーブルの作成はAPIサーバーの起動処理では行わず、このCLI（dynamodb-initコンテナ）で行う
+    parser = argparse.ArgumentParser(description="DynamoDBテーブルの管理")
+    parser.add_argument("command", nargs="?", choices=["create", "list"], default="list",
+                        help="create: テーブルを作成してから一覧を表示 / list: テーブルの一覧を表示")
+    args = parser.parse_args()
+
+    if args.command == "create":
+        create_dynamodb_tables()
     list_tables()
@@ -0,0 +1,496 @@
+"""
+単一ノード向けの追記型ログによるスレッド・メッセージのストレージ
+
+- 変更はレコードとしてセグメントファイル（segment-000001.log …）へ追記し、
+  セグメントが一定サイズを超えたら次のセグメントへ切り替えます
+- 書き込みはグループコミットで行います。fsyncの実行中に届いたレコードは
+  次の1回の書き込みとfsyncでまとめて永続化します
+- メモリ上のインデックス（スレッドのメタデータと、メッセージのレコードの位置）は、
+  起動時にスナップショットとスナップショット以降のログ（末尾）から再構築します
+- スレッドの履歴はmmapしたセグメントから読み込みます
+
+レコードの形式: [ペイロード長 uint32][CRC32 uint32][ペイロード（JSON）]
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from data.repository import ThreadRepository
+
+# セグメントを切り替えるサイズ（バイト）
+LOG_STORE_SEGMENT_BYTES = int(os.getenv('LOG_STORE_SEGMENT_BYTES', str(64 * 1024 * 1024)))
+# コミットごとにfsyncするかどうか（falseの場合はOSのページキャッシュへの書き込みまで）
+LOG_STORE_FSYNC = os.getenv('LOG_STORE_FSYNC', 'true').lower() == 'true'
+# スナップショットを作成する間隔（前回のスナップショットからのレコード数）
+LOG_STORE_SNAPSHOT_RECORDS = int(os.getenv('LOG_STORE_SNAPSHOT_RECORDS', '1000000'))
+
+RECORD_HEADER = struct.Struct('<II')
+SNAPSHOT_HEADER = struct.Struct('<4sI')
+SNAPSHOT_MAGIC = b'LSS1'
+SNAPSHOT_FILE = 'snapshot.bin'
+
+# レコードの位置は (セグメント番号 << OFFSET_BITS) | セグメント内のオフセット で表す
+OFFSET_BITS = 40
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+
+# レコードの種類
+OP_THREAD = 't'
+OP_MESSAGE = 'm'
+OP_DELETE = 'd'
+
+
+def _segment_name(segment: int) -> str:
+    return f"segment-{segment:06d}.log"
+
+
+def _encode(record: Dict[str, Any]) -> bytes:
+    payload = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class _ThreadEntry:
+    """インデックス上のスレッド1件（メッセージはレコードの位置と長さのみを保持）"""
+
+    __slots__ = ('meta', 'positions', 'lengths')
+
+    def __init__(self, meta: Dict[str, Any]):
+        self.meta = meta
+        self.positions = array('Q')
+        self.lengths = array('I')
+
+
+class LogThreadRepository(ThreadRepository):
+    """
+    追記型ログに保存するリポジトリ
+
+    ログへの書き込みとfsyncはバックグラウンドのスレッドがまとめて行い、
+    書き込みに成功したレコードのみをインデックスへ反映します（返すFutureはfsync後に完了）。
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = LOG_STORE_SEGMENT_BYTES,
+        fsync: bool = LOG_STORE_FSYNC,
+        snapshot_records: int = LOG_STORE_SNAPSHOT_RECORDS
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.snapshot_records = snapshot_records
+        os.makedirs(directory, exist_ok=True)
+
+        self._index: Dict[int, _ThreadEntry] = {}
+        self._max_thread_id = 0
+        self._max_message_id = 0
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[Dict[str, Any], bytes, Future]] = []
+        # スレッドごとの書き込み待ちのレコード数
+        self._pending_threads: Dict[int, int] = {}
+        self._records_since_snapshot = 0
+        self._closed = False
+        # 書き込みに失敗し、ログの末尾を戻せなかった場合のエラー
+        self._failed: Optional[Exception] = None
+        # ログの末尾の位置（フラッシュ用スレッドが書き込みの成功後に進める）
+        self._active_segment = 1
+        self._active_size = 0
+
+        # 書き込み中のセグメント（フラッシュ用スレッドのみが使う）
+        self._file = None
+        self._file_segment = 0
+        # 読み込み用のmmap（セグメント番号ごと）
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._maps_lock = threading.Lock()
+
+        self.stats = {
+            "records": 0,
+            "commits": 0,
+            "snapshots": 0,
+            "recoverySeconds": 0.0,
+            "recoveredFromSnapshot": False,
+            "replayedRecords": 0,
+            "truncatedBytes": 0
+        }
+
+        self._flusher: Optional[threading.Thread] = None
+
+    def open(self) -> None:
+        """インデックスを復旧し、グループコミット用のスレッドを開始します"""
+        self._recover()
+        self._flusher = threading.Thread(target=self._flush_loop, name='log-store-flush', daemon=True)
+        self._flusher.start()
+
+    # --- 復旧 ---
+
+    def _segments(self) -> List[int]:
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith('segment-') and name.endswith('.log'):
+                segments.append(int(name[len('segment-'):-len('.log')]))
+        return sorted(segments)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _recover(self) -> None:
+        """スナップショットとログの末尾からインデックスを再構築します"""
+        started = time.perf_counter()
+        tail_segment, tail_offset = self._load_snapshot()
+
+        segments = self._segments()
+        for i, segment in enumerate(segments):
+            if segment < tail_segment:
+                continue
+            start = tail_offset if segment == tail_segment else 0
+            self._replay_segment(segment, start, is_last=i == len(segments) - 1)
+
+        self._active_segment = segments[-1] if segments else 1
+        path = self._path(_segment_name(self._active_segment))
+        self._active_size = os.path.getsize(path) if os.path.exists(path) else 0
+
+        self.stats["recoverySeconds"] = round(time.perf_counter() - started, 3)
+        print(
+            f"ログストレージを復旧しました: スレッド数={len(self._index)}, "
+            f"再生したレコード数={self.stats['replayedRecords']}, {self.stats['recoverySeconds']}秒"
+        )
+
+    def _replay_segment(self, segment: int, start: int, is_last: bool) -> None:
+        """セグメントのstart以降のレコードをインデックスへ反映します"""
+        path = self._path(_segment_name(segment))
+        size = os.path.getsize(path)
+        if size <= start:
+            return
+
+        offset = start
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            while offset + RECORD_HEADER.size <= size:
+                length, crc = RECORD_HEADER.unpack_from(mm, offset)
+                end = offset + RECORD_HEADER.size + length
+                if end > size:
+                    break
+                payload = mm[offset + RECORD_HEADER.size:end]
+                if zlib.crc32(payload) != crc:
+                    break
+                self._apply(json.loads(payload), (segment << OFFSET_BITS) | offset, length)
+                self.stats["replayedRecords"] += 1
+                offset = end
+
+        if offset < size:
+            if not is_last:
+                raise RuntimeError(f"ログのセグメント {segment} のオフセット {offset} が壊れています")
+            # 書き込み途中で停止した末尾のレコードを切り捨てる
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+            self.stats["truncatedBytes"] = size - offset
+            print(f"ログの末尾の不完全なレコードを切り捨てました: segment={segment}, {size - offset}バイト")
+
+    def _load_snapshot(self) -> Tuple[int, int]:
+        """
+        スナップショットを読み込みます
+
+        Returns:
+            Tuple: スナップショットに含まれるログの末尾の位置（セグメント番号, オフセット）
+        """
+        path = self._path(SNAPSHOT_FILE)
+        if not os.path.exists(path):
+            return 0, 0
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        body, crc = data[:-4], data[-4:]
+        if len(data) < SNAPSHOT_HEADER.size + 4 or zlib.crc32(body) != struct.unpack('<I', crc)[0]:
+            print("スナップショットが壊れているため、ログ全体からインデックスを再構築します")
+            return 0, 0
+
+        magic, header_size = SNAPSHOT_HEADER.unpack_from(body, 0)
+        if magic != SNAPSHOT_MAGIC:
+            return 0, 0
+        offset = SNAPSHOT_HEADER.size
+        header = json.loads(body[offset:offset + header_size])
+        offset += header_size
+
+        view = memoryview(body)
+        for thread_id, meta, count in header["threads"]:
+            entry = _ThreadEntry(meta)
+            entry.positions.frombytes(view[offset:offset + count * 8])
+            offset += count * 8
+            entry.lengths.frombytes(view[offset:offset + count * 4])
+            offset += count * 4
+            self._index[thread_id] = entry
+
+        self._max_thread_id = header["maxThreadId"]
+        self._max_message_id = header["maxMessageId"]
+        self.stats["recoveredFromSnapshot"] = True
+        return tuple(header["tail"])
+
+    # --- インデックス ---
+
+    def _apply(self, record: Dict[str, Any], position: int, length: int) -> None:
+        """レコードをインデックスへ反映します"""
+        op = record['o']
+        thread_id = record['id']
+
+        if op == OP_THREAD:
+            entry = self._index.get(thread_id)
+            if entry is None:
+                self._index[thread_id] = _ThreadEntry(record['t'])
+            else:
+                entry.meta = record['t']
+            self._max_thread_id = max(self._max_thread_id, thread_id)
+        elif op == OP_MESSAGE:
+            message = record['m']
+            entry = self._index.get(thread_id)
+            if entry is None:
+                entry = self._index[thread_id] = _ThreadEntry({"id": thread_id})
+            entry.positions.append(position)
+            entry.lengths.append(length)
+            entry.meta["updatedAt"] = max(entry.meta.get("updatedAt", 0), message["timestamp"])
+            self._max_message_id = max(self._max_message_id, message["id"])
+        elif op == OP_DELETE:
+            self._index.pop(thread_id, None)
+
+    # --- 書き込み ---
+
+    def _append(self, record: Dict[str, Any]) -> Future:
+        data = _encode(record)
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Log store is closed")
+            if self._failed is not None:
+                raise RuntimeError(f"Log store is unavailable after a write error: {self._failed}")
+            self._pending.append((record, data, future))
+            self._pending_threads[record['id']] = self._pending_threads.get(record['id'], 0) + 1
+            self._cond.notify()
+        return future
+
+    def _write_placed(self, placed: List[Tuple[int, int, Dict[str, Any], bytes, Future]]) -> None:
+        """位置を割り当てたレコードをセグメントごとにまとめて書き込み、fsyncします"""
+        i = 0
+        while i < len(placed):
+            segment = placed[i][0]
+            j = i
+            while j < len(placed) and placed[j][0] == segment:
+                j += 1
+
+            if self._file is None or self._file_segment != segment:
+                if self._file is not None:
+                    self._file.close()
+                self._file = open(self._path(_segment_name(segment)), 'ab', buffering=0)
+                self._file_segment = segment
+
+            self._file.write(b''.join(data for _, _, _, data, _ in placed[i:j]))
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            i = j
+
+    def _rollback(self, segment: int, size: int) -> None:
+        """書き込みに失敗したバッチを取り消し、ログの末尾を書き込み前の位置に戻します"""
+        try:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            for created in self._segments():
+                if created > segment:
+                    os.remove(self._path(_segment_name(created)))
+            path = self._path(_segment_name(segment))
+            if os.path.exists(path):
+                os.truncate(path, size)
+        except OSError as e:
+            # 末尾を戻せない場合は、インデックスとログの位置がずれないよう以降の書き込みを受け付けない
+            print(f"ログの末尾を戻せないため、書き込みを停止します: {e}")
+            with self._cond:
+                self._failed = e
+
+    def _commit(self, batch: List[Tuple[Dict[str, Any], bytes, Future]]) -> None:
+        """
+        レコードに位置を割り当てて書き込みます
+        インデックスへは書き込みが成功した場合のみ反映します
+        """
+        segment, size = self._active_segment, self._active_size
+        placed = []
+        for record, data, future in batch:
+            if size > 0 and size + len(data) > self.segment_bytes:
+                segment += 1
+                size = 0
+            placed.append((segment, size, record, data, future))
+            size += len(data)
+
+        error = self._failed
+        if error is None:
+            try:
+                self._write_placed(placed)
+            except Exception as e:
+                error = e
+                print(f"ログへの書き込み中にエラーが発生しました: {e}")
+                self._rollback(self._active_segment, self._active_size)
+
+        with self._cond:
+            if error is None:
+                for record_segment, offset, record, data, _ in placed:
+                    self._apply(record, (record_segment << OFFSET_BITS) | offset, len(data) - RECORD_HEADER.size)
+                self._active_segment, self._active_size = segment, size
+                self._records_since_snapshot += len(batch)
+                self.stats["records"] += len(batch)
+                self.stats["commits"] += 1
+            for record, _, _ in batch:
+                remaining = self._pending_threads[record['id']] - 1
+                if remaining:
+                    self._pending_threads[record['id']] = remaining
+                else:
+                    del self._pending_threads[record['id']]
+            self._cond.notify_all()
+
+        for _, _, future in batch:
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    def _flush_loop(self) -> None:
+        """書き込み待ちのレコードをまとめて永続化します（グループコミット）"""
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending and self._closed:
+                    return
+                batch, self._pending = self._pending, []
+
+            self._commit(batch)
+
+            if self._records_since_snapshot >= self.snapshot_records:
+                self._write_snapshot()
+
+    def _write_snapshot(self) -> None:
+        """インデックスのスナップショットを作成します（フラッシュ用スレッドで実行）"""
+        with self._cond:
+            # インデックスにはログへ書き込み済みのレコードのみが反映されている
+            tail = [self._active_segment, self._active_size]
+            threads = [
+                (thread_id, dict(entry.meta), array('Q', entry.positions), array('I', entry.lengths))
+                for thread_id, entry in self._index.items()
+            ]
+            max_thread_id, max_message_id = self._max_thread_id, self._max_message_id
+            self._records_since_snapshot = 0
+
+        header = json.dumps({
+            "tail": tail,
+            "maxThreadId": max_thread_id,
+            "maxMessageId": max_message_id,
+            "threads": [[thread_id, meta, len(positions)] for thread_id, meta, positions, _ in threads]
+        }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+        parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(header)), header]
+        for _, _, positions, lengths in threads:
+            parts.append(positions.tobytes())
+            parts.append(lengths.tobytes())
+        body = b''.join(parts)
+
+        path = self._path(SNAPSHOT_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+            f.write(struct.pack('<I', zlib.crc32(body)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self.stats["snapshots"] += 1
+
+    # --- 読み込み ---
+
+    def _map(self, segment: int, end: int) -> mmap.mmap:
+        """セグメントのmmapを返します（書き込み中のセグメントは必要に応じて再マップ）"""
+        with self._maps_lock:
+            mm = self._maps.get(segment)
+            if mm is None or len(mm) < end:
+                with open(self._path(_segment_name(segment)), 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[segment] = mm
+            return mm
+
+    def load_thread(self, thread_id: int) -> Optional[Dict[str, Any]]:
+        with self._cond:
+            # このスレッドの書き込み待ちのレコードがログへ書き込まれるまで待つ
+            while self._pending_threads.get(thread_id):
+                self._cond.wait()
+            entry = self._index.get(thread_id)
+            if entry is None:
+                return None
+            meta = dict(entry.meta)
+            positions = array('Q', entry.positions)
+            lengths = array('I', entry.lengths)
+
+        # 同じIDのメッセージは後から書き込んだものを使う（順序は最初に書き込んだ位置）
+        messages: Dict[int, Dict[str, Any]] = {}
+        for position, length in zip(positions, lengths):
+            segment, offset = position >> OFFSET_BITS, position & OFFSET_MASK
+            start = offset + RECORD_HEADER.size
+            mm = self._map(segment, start + length)
+            message = json.loads(mm[start:start + length])['m']
+            messages[message["id"]] = message
+
+        meta["messages"] = list(messages.values())
+        return meta
+
+    def has_thread(self, thread_id: int) -> bool:
+        with self._cond:
+            return thread_id in self._index
+
+    def list_thread_summaries(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            return [
+                dict(entry.meta, messages=[], messageCount=len(entry.positions))
+                for entry in self._index.values()
+            ]
+
+    def save_thread(self, thread: Dict[str, Any]) -> Future:
+        meta = {key: value for key, value in thread.items() if key != "messages"}
+        return self._append({'o': OP_THREAD, 'id': thread["id"], 't': meta})
+
+    def append_message(self, thread_id: int, message: Dict[str, Any]) -> Future:
+        return self._append({'o': OP_MESSAGE, 'id': thread_id, 'm': message})
+
+    def delete_thread(self, thread_id: int) -> Future:
+        return self._append({'o': OP_DELETE, 'id': thread_id})
+
+    def max_ids(self) -> Tuple[int, int]:
+        with self._cond:
+            return self._max_thread_id, self._max_message_id
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self.stats)
+            stats.update({
+                "backend": "log",
+                "threads": len(self._index),
+                "activeSegment": self._active_segment,
+                "activeSegmentBytes": self._active_size,
+                "pendingRecords": len(self._pending)
+            })
+        stats["recordsPerCommit"] = round(stats["records"] / stats["commits"], 2) if stats["commits"] else 0.0
+        return stats
+
+    def close(self) -> None:
+        with self._cond:
+            if self._closed or self._flusher is None:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+        self._write_snapshot()
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        with self._maps_lock:
+            for mm in self._maps.values():
+                mm.close()
+            self._maps.clear()
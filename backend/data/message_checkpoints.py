@@ -0,0 +1,287 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from data.dynamodb_connection import get_dynamodb_resource
+from data.message_schema import ITEM_TYPE_MESSAGE, format_timestamp
+
+# チェックポイントを書き込む間隔（秒）
+CHECKPOINT_INTERVAL_SECONDS = float(os.getenv('CHECKPOINT_INTERVAL_SECONDS', '2.0'))
+# 前回の書き込みからこの文字数以上増えたら即座に書き込む
+CHECKPOINT_INTERVAL_CHARS = int(os.getenv('CHECKPOINT_INTERVAL_CHARS', '500'))
+
+# 最後の書き込みからこの時間（秒）以上経過した生成中のメッセージを、書きかけとみなす
+CHECKPOINT_ORPHAN_AFTER_SECONDS = float(
+    os.getenv('CHECKPOINT_ORPHAN_AFTER_SECONDS', str(CHECKPOINT_INTERVAL_SECONDS * 5))
+)
+
+# 生成途中のメッセージの状態
+STATUS_STREAMING = 'streaming'
+# 起動時に見つかった書きかけのメッセージに付ける状態
+STATUS_ORPHANED = 'truncated'
+
+# 生成中のメッセージのみを含むスパースインデックス（streaming_status は生成中のみ設定する）
+STREAMING_INDEX = 'streaming-index'
+
+
+class _InFlightReply:
+    """生成中のアシスタントメッセージのメモリ上の状態"""
+
+    def __init__(self, thread_id: int, message: Dict[str, Any], user_id: str):
+        self.thread_id = thread_id
+        self.message = message
+        self.user_id = user_id
+        self.flushed_chars = 0
+        self.last_flush = time.monotonic()
+        self.writes = 0
+        self.chunks = 0
+
+
+class MessageCheckpointWriter:
+    """
+    生成中のアシスタントメッセージをwrite-behindで `{env}-chat-messages` テーブルに書き込むクラス
+
+    チャンクごとには書き込まず、メモリ上の最新の本文を一定時間または一定文字数ごとに
+    まとめて書き込みます。完了時には最終レコードを書き込みます。
+    1件の応答あたりの書き込み回数は概ね
+    1 + 文字数 / interval_chars + 生成時間 / interval_seconds 回に抑えられます。
+    本文が増えない間も orphan_after_seconds の半分ごとに書き込み、生成中であることを示します。
+    """
+
+    def __init__(
+        self,
+        table_name: Optional[str] = None,
+        interval_seconds: float = CHECKPOINT_INTERVAL_SECONDS,
+        interval_chars: int = CHECKPOINT_INTERVAL_CHARS,
+        orphan_after_seconds: float = CHECKPOINT_ORPHAN_AFTER_SECONDS
+    ):
+        env = os.getenv('ENV', 'dev')
+        self.table_name = table_name or f"{env}-chat-messages"
+        self.interval_seconds = interval_seconds
+        self.interval_chars = interval_chars
+        self.orphan_after_seconds = orphan_after_seconds
+        self.in_flight: Dict[int, _InFlightReply] = {}
+        self.stats = {'replies': 0, 'chunks': 0, 'writes': 0, 'failedWrites': 0, 'recoveredOrphans': 0}
+        # 書き込み順序を保つため、書き込みは1スレッドで順番に実行する
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint')
+        # 回復処理は書き込みを待たせないよう別のスレッドで実行する
+        self._recovery_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint-recovery')
+        self._table = None
+        self._disabled = False
+        self._task: Optional[asyncio.Task] = None
+        self._recover_pending = False
+
+    def _get_table(self):
+        """テーブルを取得します（初回のみ接続する）"""
+        if self._table is None and not self._disabled:
+            dynamodb = get_dynamodb_resource()
+            if dynamodb is None:
+                print(f"チェックポイントの書き込みを無効化します: {self.table_name} に接続できません")
+                self._disabled = True
+                return None
+            self._table = dynamodb.Table(self.table_name)
+        return self._table
+
+    def _put(self, item: Dict[str, Any]) -> None:
+        """チェックポイントを書き込みます（書き込みスレッドで実行）"""
+        from botocore.exceptions import ClientError
+
+        table = self._get_table()
+        if table is None:
+            return
+        try:
+            table.put_item(Item=item)
+            self.stats['writes'] += 1
+        except ClientError as e:
+            self.stats['failedWrites'] += 1
+            print(f"チェックポイントの書き込み中にエラーが発生しました: {e}")
+
+    def _snapshot(self, reply: _InFlightReply, status: str) -> Dict[str, Any]:
+        message = reply.message
+        item = {
+            'thread_id': str(reply.thread_id),
+            'timestamp': format_timestamp(message['timestamp']),
+            'item_type': ITEM_TYPE_MESSAGE,
+            'message_id': message['id'],
+            'user_id': reply.user_id,
+            'sender': message['sender'],
+            'text': message['text'],
+            'status': status,
+            'updated_at': int(time.time() * 1000)
+        }
+        if status == STATUS_STREAMING:
+            item['streaming_status'] = STATUS_STREAMING
+        return item
+
+    def _flush(self, reply: _InFlightReply, status: str = STATUS_STREAMING) -> None:
+        if self._recover_pending:
+            # 回復処理を遅延している場合は、最初の書き込みの前に実行する
+            self._recover_pending = False
+            self._recovery_executor.submit(self.recover_orphans)
+        reply.flushed_chars = len(reply.message['text'])
+        reply.last_flush = time.monotonic()
+        reply.writes += 1
+        self._executor.submit(self._put, self._snapshot(reply, status))
+
+    def begin(self, thread_id: int, message: Dict[str, Any], user_id: str) -> None:
+        """
+        生成中のメッセージを登録します
+
+        Args:
+            thread_id: メッセージが属するスレッドのID
+            message: 生成中のメッセージ（本文は生成に合わせて更新される）
+            user_id: メッセージを生成したユーザーのID
+        """
+        self.in_flight[message['id']] = _InFlightReply(thread_id, message, user_id)
+
+    def update(self, message_id: int) -> None:
+        """
+        メッセージにチャンクが追加されたことを通知します
+        前回の書き込みから一定文字数を超えた場合のみ書き込みます
+        """
+        reply = self.in_flight.get(message_id)
+        if reply is None:
+            return
+        reply.chunks += 1
+        self.stats['chunks'] += 1
+        if len(reply.message['text']) - reply.flushed_chars >= self.interval_chars:
+            self._flush(reply)
+
+    def finish(self, message_id: int, status: str) -> None:
+        """
+        生成が終了したメッセージの最終レコードを書き込みます
+
+        Args:
+            message_id: メッセージID
+            status: 最終的な状態（completed / truncated）
+        """
+        reply = self.in_flight.pop(message_id, None)
+        if reply is None:
+            return
+        self._flush(reply, status)
+        self.stats['replies'] += 1
+        print(f"チェックポイント完了: message_id={message_id}, 書き込み回数={reply.writes}, チャンク数={reply.chunks}")
+
+    def discard_thread(self, thread_id: int) -> None:
+        """削除されたスレッドの生成中メッセージを、書き込まずに破棄します"""
+        for message_id, reply in list(self.in_flight.items()):
+            if reply.thread_id == thread_id:
+                del self.in_flight[message_id]
+
+    async def drain(self) -> None:
+        """書き込み待ちのチェックポイントがすべて書き込まれるまで待ちます"""
+        await asyncio.wrap_future(self._executor.submit(lambda: None))
+
+    def flush_due(self) -> None:
+        """
+        前回の書き込みから一定時間が経過し、未書き込みの変更があるメッセージを書き込みます
+        変更がない場合も、他のプロセスに書きかけとみなされる前に書き込みます
+        """
+        now = time.monotonic()
+        for reply in list(self.in_flight.values()):
+            dirty = len(reply.message['text']) != reply.flushed_chars
+            elapsed = now - reply.last_flush
+            if (dirty and elapsed >= self.interval_seconds) or elapsed >= self.orphan_after_seconds / 2:
+                self._flush(reply)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """書き込み回数などの統計情報を返します"""
+        replies = self.stats['replies']
+        chunks = self.stats['chunks']
+        return {
+            **self.stats,
+            'inFlight': len(self.in_flight),
+            'writesPerReply': self.stats['writes'] / replies if replies else 0.0,
+            # チャンクごとに書き込んだ場合と比べた書き込み回数の割合
+            'writeAmplification': self.stats['writes'] / chunks if chunks else 0.0
+        }
+
+    def recover_orphans(self) -> int:
+        """
+        生成途中のまま残ったメッセージを"truncated"として確定させます
+
+        生成中のメッセージのみを含むスパースインデックスを、最後の書き込みから
+        orphan_after_seconds 以上経過したものに絞ってQueryします。
+        生成中のメッセージは定期的に書き込まれるため、他のプロセスで生成中のメッセージは対象になりません。
+
+        Returns:
+            int: 確定させたメッセージの件数
+        """
+        from boto3.dynamodb.conditions import Attr, Key
+        from botocore.exceptions import ClientError
+
+        table = self._get_table()
+        if table is None:
+            return 0
+
+        recovered = 0
+        cutoff = int((time.time() - self.orphan_after_seconds) * 1000)
+        query_kwargs = {
+            'IndexName': STREAMING_INDEX,
+            'KeyConditionExpression': Key('streaming_status').eq(STATUS_STREAMING) & Key('updated_at').lt(cutoff)
+        }
+        try:
+            while True:
+                response = table.query(**query_kwargs)
+                for item in response.get('Items', []):
+                    try:
+                        table.update_item(
+                            Key={'thread_id': item['thread_id'], 'timestamp': item['timestamp']},
+                            UpdateExpression='SET #status = :status REMOVE streaming_status',
+                            # 回復処理の間に書き込まれた場合は生成中として扱う
+                            ConditionExpression=Attr('updated_at').eq(item['updated_at']),
+                            ExpressionAttributeNames={'#status': 'status'},
+                            ExpressionAttributeValues={':status': STATUS_ORPHANED}
+                        )
+                        recovered += 1
+                    except ClientError as e:
+                        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                            raise
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except ClientError as e:
+            # インデックスがない既存のテーブルではテーブル全体をScanせずに回復処理をスキップする
+            print(f"書きかけのメッセージの回復中にエラーが発生しました（{STREAMING_INDEX} が必要です）: {e}")
+
+        self.stats['recoveredOrphans'] += recovered
+        print(f"書きかけのメッセージを {recovered} 件確定しました")
+        return recovered
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            self.flush_due()
+
+    async def start(self, recover_now: bool = True) -> None:
+        """
+        起動時の回復処理と、時間間隔での書き込みを開始します
+
+        回復処理は書き込みとは別のスレッドで実行し、完了を待たずに戻ります。
+        このプロセスのチェックポイントは最後の書き込みから間もないため、回復処理の対象になりません。
+
+        Args:
+            recover_now: Falseの場合は最初の書き込みまで回復処理（DynamoDBへの接続）を遅延する
+        """
+        if recover_now:
+            self._recovery_executor.submit(self.recover_orphans)
+        else:
+            self._recover_pending = True
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """時間間隔での書き込みを停止し、未書き込みの変更をすべて書き込みます"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for reply in list(self.in_flight.values()):
+            if len(reply.message['text']) != reply.flushed_chars:
+                self._flush(reply)
+        self._recovery_executor.shutdown(wait=False, cancel_futures=True)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+
+
+CHECKPOINTS = MessageCheckpointWriter()
@@ -0,0 +1,32 @@
+"""
+`{env}-chat-messages` テーブルのアイテム形式
+
+timestamp（ソートキー）は文字列型のため、ミリ秒のUNIXタイムスタンプを
+13桁にゼロ埋めして、文字列の順序と時系列の順序を一致させます。
+スレッドのメタデータ（タイトル・アクティブ状態など）は、同じパーティションに
+ソートキーが THREAD_METADATA_SORT_KEY のアイテムとして保存します。
+"""
+from typing import Any, Dict
+
+TIMESTAMP_DIGITS = 13
+
+ITEM_TYPE_MESSAGE = 'message'
+ITEM_TYPE_THREAD = 'thread'
+
+# メッセージのtimestamp（数字のみ）より前に並ぶソートキー
+THREAD_METADATA_SORT_KEY = '#thread'
+
+
+def format_timestamp(timestamp_ms: int) -> str:
+    """ミリ秒のタイムスタンプをソートキー用の文字列に変換します"""
+    return str(int(timestamp_ms)).zfill(TIMESTAMP_DIGITS)
+
+
+def is_formatted_timestamp(value: str) -> bool:
+    """ソートキー用の形式（13桁のゼロ埋め）になっているかを返します"""
+    return len(value) == TIMESTAMP_DIGITS and value.isdigit()
+
+
+def thread_metadata_key(thread_id: int) -> Dict[str, Any]:
+    """スレッドのメタデータアイテムのキーを返します"""
+    return {'thread_id': str(thread_id), 'timestamp': THREAD_METADATA_SORT_KEY}
@@ -0,0 +1,453 @@
+"""
+`{env}-chat-messages` テーブルのスキーマ移行・バックフィルツール
+
+1. 並列Scanで全アイテムを読み込み、timestamp（ソートキー）を13桁のゼロ埋め形式に変換し、
+   item_typeを付与して書き戻します（ソートキーが変わるアイテムは新しいキーで書き込み、古いキーを削除）
+2. 移行したスレッドごとに、メッセージ数・作成日時・更新日時などを集計して
+   スレッドのメタデータアイテムを作成します
+
+進捗はチェックポイントファイルに保存され、中断しても同じコマンドで再開できます。
+スロットリングされた場合はリクエストのレートを自動的に下げます。
+
+使い方:
+    python data/migrate_messages.py [--segments 8] [--checkpoint migration_checkpoint.json] [--dry-run]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from data.dynamodb_connection import get_dynamodb_client
+from data.message_schema import (
+    ITEM_TYPE_MESSAGE, ITEM_TYPE_THREAD, THREAD_METADATA_SORT_KEY, TIMESTAMP_DIGITS,
+    format_timestamp, is_formatted_timestamp
+)
+
+# BatchWriteItemで1度に書き込めるリクエスト数の上限
+BATCH_SIZE = 25
+# 1回のScanで読み込むアイテム数
+SCAN_PAGE_SIZE = 500
+# スロットリングとして扱うエラーコード
+THROTTLING_ERRORS = (
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded'
+)
+MAX_RETRIES = 10
+
+
+class AdaptiveThrottle:
+    """
+    すべてのワーカーで共有するリクエストのレート制限
+
+    成功するたびにレートを少しずつ上げ、スロットリングされた場合は半分に下げます（AIMD）。
+    """
+
+    def __init__(self, initial_rate: float, max_rate: float, min_rate: float = 1.0):
+        self.rate = initial_rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """次のリクエストを送ってよい時刻まで待ちます"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 1.0)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            # 直後のリクエストも間隔を空ける
+            self._next_slot = max(self._next_slot, time.monotonic() + 1.0 / self.rate)
+
+
+class MigrationMetrics:
+    """移行の進捗を集計するクラス"""
+
+    def __init__(self):
+        self.counters = {
+            'scanned': 0,
+            'migrated': 0,
+            'skipped': 0,
+            'failed': 0,
+            'writeRequests': 0,
+            'throttled': 0,
+            'threadsBackfilled': 0
+        }
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                **self.counters,
+                'elapsedSeconds': round(elapsed, 1),
+                'scannedPerSecond': round(self.counters['scanned'] / elapsed, 1) if elapsed else 0.0
+            }
+
+
+class MigrationCheckpoint:
+    """
+    セグメントごとのScanの位置（LastEvaluatedKey）と、移行したスレッドIDを保存するクラス
+
+    スレッドIDはセグメントごとのファイル（{path}.threads-{segment}）へ、新しいIDだけを追記します。
+    """
+
+    def __init__(self, path: str, table_name: str, total_segments: int):
+        self.path = path
+        self._lock = threading.Lock()
+        self.state = {
+            'table': table_name,
+            'totalSegments': total_segments,
+            'segments': {str(i): {'lastKey': None, 'done': False} for i in range(total_segments)},
+            'metadataDone': False
+        }
+        resumed = os.path.exists(path)
+        if resumed:
+            with open(path) as f:
+                saved = json.load(f)
+            if saved['table'] != table_name or saved['totalSegments'] != total_segments:
+                raise ValueError(
+                    f"チェックポイント {path} は別の設定（table={saved['table']}, "
+                    f"segments={saved['totalSegments']}）で作成されています"
+                )
+            self.state = saved
+        # セグメントごとの移行したスレッドID（各セグメントのワーカーだけが更新する）
+        self._thread_ids: Dict[int, Set[str]] = {
+            i: self._load_thread_ids(i, resumed) for i in range(total_segments)
+        }
+
+    def _thread_ids_path(self, segment: int) -> str:
+        return f"{self.path}.threads-{segment}"
+
+    def _load_thread_ids(self, segment: int, resumed: bool) -> Set[str]:
+        path = self._thread_ids_path(segment)
+        if not os.path.exists(path):
+            return set()
+        if not resumed:
+            # 以前の移行で残ったファイルは使わない
+            os.remove(path)
+            return set()
+        with open(path) as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def segment(self, segment: int) -> Dict[str, Any]:
+        return self.state['segments'][str(segment)]
+
+    def thread_ids(self) -> List[str]:
+        """すべてのセグメントで移行したスレッドIDを返します"""
+        return sorted(set().union(*self._thread_ids.values()))
+
+    def update_segment(
+        self,
+        segment: int,
+        last_key: Optional[Dict[str, Any]],
+        thread_ids: List[str],
+        save: bool = True
+    ) -> None:
+        """
+        Scanの1ページ分の書き込みが完了した時点の位置とスレッドIDを記録します
+
+        Args:
+            save: Falseの場合はファイルに保存せず、メモリ上でのみ記録する（dry-run用）
+        """
+        # 新しいスレッドIDだけを追記する（Scanの位置より先に保存し、再開時に漏れないようにする）
+        known = self._thread_ids[segment]
+        new_ids = [thread_id for thread_id in dict.fromkeys(thread_ids) if thread_id not in known]
+        known.update(new_ids)
+        if save and new_ids:
+            with open(self._thread_ids_path(segment), 'a') as f:
+                f.write(''.join(f"{thread_id}\n" for thread_id in new_ids))
+
+        with self._lock:
+            state = self.segment(segment)
+            state['lastKey'] = last_key
+            state['done'] = last_key is None
+            if save:
+                self._save()
+
+    def mark_metadata_done(self) -> None:
+        with self._lock:
+            self.state['metadataDone'] = True
+            self._save()
+
+    def _save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+
+def parse_timestamp(value: str) -> int:
+    """旧形式のtimestamp（ゼロ埋めなしのミリ秒、またはISO 8601）をミリ秒に変換します"""
+    if value.isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000)
+
+
+def transform_item(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    メッセージアイテムを新しい形式に変換します
+
+    Returns:
+        Dict: 変換後のアイテム（移行済み・移行対象外の場合はNone）
+    """
+    item_type = item.get('item_type', {}).get('S')
+    timestamp = item['timestamp']['S']
+    if item_type == ITEM_TYPE_THREAD or timestamp == THREAD_METADATA_SORT_KEY:
+        return None
+    if item_type == ITEM_TYPE_MESSAGE and is_formatted_timestamp(timestamp):
+        return None
+
+    new_item = dict(item)
+    new_item['timestamp'] = {'S': format_timestamp(parse_timestamp(timestamp))}
+    new_item['item_type'] = {'S': ITEM_TYPE_MESSAGE}
+    return new_item
+
+
+class MessageMigration:
+    """並列Scanによる移行処理"""
+
+    def __init__(
+        self,
+        client,
+        table_name: str,
+        checkpoint: MigrationCheckpoint,
+        throttle: AdaptiveThrottle,
+        metrics: MigrationMetrics,
+        workers: int,
+        dry_run: bool = False
+    ):
+        self.client = client
+        self.table_name = table_name
+        self.checkpoint = checkpoint
+        self.throttle = throttle
+        self.metrics = metrics
+        self.workers = workers
+        self.dry_run = dry_run
+
+    def _call(self, operation: Callable[..., Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        """レート制限をかけ、スロットリングされた場合はリトライしてリクエストを送ります"""
+        from botocore.exceptions import ClientError
+
+        for attempt in range(MAX_RETRIES):
+            self.throttle.acquire()
+            try:
+                response = operation(**kwargs)
+                self.throttle.on_success()
+                return response
+            except ClientError as e:
+                if e.response['Error']['Code'] not in THROTTLING_ERRORS:
+                    raise
+                self.metrics.add('throttled')
+                self.throttle.on_throttle()
+        raise RuntimeError(f"リクエストが {MAX_RETRIES} 回スロットリングされました")
+
+    def _write(self, requests: List[Dict[str, Any]]) -> None:
+        """BatchWriteItemで書き込みます（未処理のリクエストはリトライ）"""
+        if self.dry_run:
+            return
+        for i in range(0, len(requests), BATCH_SIZE):
+            batch = requests[i:i + BATCH_SIZE]
+            for _ in range(MAX_RETRIES):
+                response = self._call(self.client.batch_write_item, RequestItems={self.table_name: batch})
+                self.metrics.add('writeRequests')
+                batch = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                if not batch:
+                    break
+                self.metrics.add('throttled')
+                self.throttle.on_throttle()
+            else:
+                raise RuntimeError(f"{len(batch)} 件の書き込みが完了しませんでした")
+
+    def migrate_segment(self, segment: int, total_segments: int) -> None:
+        """1セグメント分のアイテムを移行します"""
+        state = self.checkpoint.segment(segment)
+        if state['done']:
+            return
+
+        scan_kwargs = {
+            'TableName': self.table_name,
+            'Segment': segment,
+            'TotalSegments': total_segments,
+            'Limit': SCAN_PAGE_SIZE
+        }
+        if state['lastKey'] is not None:
+            scan_kwargs['ExclusiveStartKey'] = state['lastKey']
+
+        while True:
+            response = self._call(self.client.scan, **scan_kwargs)
+            items = response.get('Items', [])
+            self.metrics.add('scanned', len(items))
+
+            puts = []
+            deletes = []
+            thread_ids = []
+            for item in items:
+                # 移行済みのメッセージを含め、メッセージがあるスレッドはすべてメタデータの作成対象にする
+                is_metadata = (
+                    item['timestamp']['S'] == THREAD_METADATA_SORT_KEY
+                    or item.get('item_type', {}).get('S') == ITEM_TYPE_THREAD
+                )
+                if not is_metadata:
+                    thread_ids.append(item['thread_id']['S'])
+                try:
+                    new_item = transform_item(item)
+                except ValueError:
+                    print(f"timestampを変換できないアイテムをスキップします: {item['thread_id']['S']} / {item['timestamp']['S']}")
+                    self.metrics.add('failed')
+                    continue
+                if new_item is None:
+                    self.metrics.add('skipped')
+                    continue
+
+                puts.append({'PutRequest': {'Item': new_item}})
+                # ソートキーが変わる場合は古いキーのアイテムを削除する
+                if new_item['timestamp'] != item['timestamp']:
+                    deletes.append({'DeleteRequest': {'Key': {
+                        'thread_id': item['thread_id'], 'timestamp': item['timestamp']
+                    }}})
+                self.metrics.add('migrated')
+
+            # 新しいキーへの書き込みがすべて完了してから古いキーを削除する
+            # （書き込みが完了しなかった場合に、古いアイテムだけが削除されるのを防ぐ）
+            self._write(puts)
+            self._write(deletes)
+
+            # 書き込みが完了してからScanの位置を保存する（再開時に同じページを処理しても結果は変わらない）
+            last_key = response.get('LastEvaluatedKey')
+            self.checkpoint.update_segment(segment, last_key, thread_ids, save=not self.dry_run)
+            if last_key is None:
+                return
+            scan_kwargs['ExclusiveStartKey'] = last_key
+
+    def backfill_thread(self, thread_id: str) -> None:
+        """スレッドのメッセージを集計し、メタデータアイテムを作成・更新します"""
+        key_condition = {
+            'TableName': self.table_name,
+            'KeyConditionExpression': 'thread_id = :thread_id AND #ts BETWEEN :first AND :last',
+            'ExpressionAttributeNames': {'#ts': 'timestamp'},
+            'ExpressionAttributeValues': {
+                ':thread_id': {'S': thread_id},
+                ':first': {'S': '0' * TIMESTAMP_DIGITS},
+                ':last': {'S': '9' * TIMESTAMP_DIGITS}
+            }
+        }
+
+        count = 0
+        count_kwargs = dict(key_condition, Select='COUNT')
+        while True:
+            response = self._call(self.client.query, **count_kwargs)
+            count += response['Count']
+            if 'LastEvaluatedKey' not in response:
+                break
+            count_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        if count == 0:
+            return
+
+        first = self._call(self.client.query, **key_condition, Limit=1, ScanIndexForward=True)['Items'][0]
+        last = self._call(self.client.query, **key_condition, Limit=1, ScanIndexForward=False)['Items'][0]
+
+        if not self.dry_run:
+            # タイトル・アクティブ状態・ユーザーは既存の値があれば上書きしない
+            self._call(
+                self.client.update_item,
+                TableName=self.table_name,
+                Key={'thread_id': {'S': thread_id}, 'timestamp': {'S': THREAD_METADATA_SORT_KEY}},
+                UpdateExpression=(
+                    'SET item_type = :item_type, messageCount = :count, '
+                    'createdAt = :created_at, updatedAt = :updated_at, '
+                    'title = if_not_exists(title, :title), '
+                    'isActive = if_not_exists(isActive, :is_active), '
+                    'user_id = if_not_exists(user_id, :user_id)'
+                ),
+                ExpressionAttributeValues={
+                    ':item_type': {'S': ITEM_TYPE_THREAD},
+                    ':count': {'N': str(count)},
+                    ':created_at': {'N': str(int(first['timestamp']['S']))},
+                    ':updated_at': {'N': str(int(last['timestamp']['S']))},
+                    ':title': {'S': f"Thread {thread_id}"},
+                    ':is_active': {'BOOL': True},
+                    ':user_id': first.get('user_id', {'S': 'unknown'})
+                }
+            )
+        self.metrics.add('threadsBackfilled')
+
+    def run(self) -> None:
+        total_segments = self.checkpoint.state['totalSegments']
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='migration') as pool:
+            # 1. セグメントごとに並列でアイテムを移行
+            futures = [pool.submit(self.migrate_segment, i, total_segments) for i in range(total_segments)]
+            for future in futures:
+                future.result()
+
+            # 2. スレッドのメタデータを作成
+            if not self.checkpoint.state['metadataDone']:
+                futures = [pool.submit(self.backfill_thread, t) for t in self.checkpoint.thread_ids()]
+                for future in futures:
+                    future.result()
+                if not self.dry_run:
+                    self.checkpoint.mark_metadata_done()
+
+
+def _report_progress(metrics: MigrationMetrics, throttle: AdaptiveThrottle, interval: float, stop: threading.Event) -> None:
+    while not stop.wait(interval):
+        print(f"進捗: {json.dumps(metrics.snapshot())} rate={throttle.rate:.1f}req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="chat-messagesテーブルのスキーマ移行・バックフィル")
+    parser.add_argument('--table', default=f"{os.getenv('ENV', 'dev')}-chat-messages", help="対象のテーブル名")
+    parser.add_argument('--segments', type=int, default=8, help="並列Scanのセグメント数")
+    parser.add_argument('--workers', type=int, default=None, help="ワーカースレッド数（デフォルトはセグメント数）")
+    parser.add_argument('--checkpoint', default='migration_checkpoint.json', help="チェックポイントファイル")
+    parser.add_argument('--initial-rate', type=float, default=50.0, help="開始時のリクエストレート（req/s）")
+    parser.add_argument('--max-rate', type=float, default=500.0, help="リクエストレートの上限（req/s）")
+    parser.add_argument('--report-interval', type=float, default=10.0, help="進捗を表示する間隔（秒）")
+    parser.add_argument('--dry-run', action='store_true', help="書き込まずに移行対象の件数だけを数える")
+    args = parser.parse_args()
+
+    client = get_dynamodb_client()
+    if not client:
+        return
+
+    checkpoint = MigrationCheckpoint(args.checkpoint, args.table, args.segments)
+    throttle = AdaptiveThrottle(args.initial_rate, args.max_rate)
+    metrics = MigrationMetrics()
+    migration = MessageMigration(
+        client, args.table, checkpoint, throttle, metrics,
+        workers=args.workers or args.segments, dry_run=args.dry_run
+    )
+
+    stop = threading.Event()
+    reporter = threading.Thread(
+        target=_report_progress, args=(metrics, throttle, args.report_interval, stop), daemon=True
+    )
+    reporter.start()
+    try:
+        migration.run()
+    finally:
+        stop.set()
+        print(f"結果: {json.dumps(metrics.snapshot())}")
+
+
+if __name__ == "__main__":
+    main()
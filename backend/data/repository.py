@@ -0,0 +1,104 @@
+"""
+スレッド・メッセージを永続化するリポジトリのインターフェース
+
+APIはメモリ上のホットストア（MOCK_THREADS）で読み書きし、変更をリポジトリへ書き込みます。
+ホットストアにないスレッドはリポジトリから読み込みます。
+"""
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+# 永続化の方式（memory: 永続化しない / log: ローカルの追記型ログ）
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'memory').lower()
+# ログ形式のストレージを保存するディレクトリ
+LOG_STORE_DIR = os.getenv('LOG_STORE_DIR', 'log_store')
+
+
+def _completed() -> Future:
+    future: Future = Future()
+    future.set_result(None)
+    return future
+
+
+class ThreadRepository(ABC):
+    """
+    スレッド・メッセージのリポジトリ
+
+    書き込みメソッドはFutureを返し、書き込みが永続化された時点で完了します。
+    """
+
+    @abstractmethod
+    def load_thread(self, thread_id: int) -> Optional[Dict[str, Any]]:
+        """スレッドをメッセージを含めて読み込みます（存在しない場合はNone）"""
+
+    @abstractmethod
+    def has_thread(self, thread_id: int) -> bool:
+        """スレッドが保存されているかを返します"""
+
+    @abstractmethod
+    def list_thread_summaries(self) -> List[Dict[str, Any]]:
+        """すべてのスレッドの概要（メッセージを含まない）を返します"""
+
+    @abstractmethod
+    def save_thread(self, thread: Dict[str, Any]) -> Future:
+        """スレッドのタイトル・アクティブ状態などを作成・更新します（メッセージは含まない）"""
+
+    @abstractmethod
+    def append_message(self, thread_id: int, message: Dict[str, Any]) -> Future:
+        """スレッドにメッセージを追加します（同じIDのメッセージは上書き）"""
+
+    @abstractmethod
+    def delete_thread(self, thread_id: int) -> Future:
+        """スレッドとそのメッセージを削除します"""
+
+    @abstractmethod
+    def max_ids(self) -> Tuple[int, int]:
+        """保存されている最大のスレッドIDとメッセージIDを返します"""
+
+    def open(self) -> None:
+        """保存されているデータを読み込める状態にします（起動時に1度だけ呼び出す）"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        """書き込み・復旧の統計情報を返します"""
+        return {"backend": STORAGE_BACKEND}
+
+    def close(self) -> None:
+        """書き込み待ちのデータを永続化して閉じます"""
+
+
+class VolatileThreadRepository(ThreadRepository):
+    """
+    何も永続化しないリポジトリ（デフォルト）
+
+    データはホットストアにのみ存在し、プロセスの再起動で失われます。
+    """
+
+    def load_thread(self, thread_id: int) -> Optional[Dict[str, Any]]:
+        return None
+
+    def has_thread(self, thread_id: int) -> bool:
+        return False
+
+    def list_thread_summaries(self) -> List[Dict[str, Any]]:
+        return []
+
+    def save_thread(self, thread: Dict[str, Any]) -> Future:
+        return _completed()
+
+    def append_message(self, thread_id: int, message: Dict[str, Any]) -> Future:
+        return _completed()
+
+    def delete_thread(self, thread_id: int) -> Future:
+        return _completed()
+
+    def max_ids(self) -> Tuple[int, int]:
+        return 0, 0
+
+
+def create_repository() -> ThreadRepository:
+    """STORAGE_BACKENDに応じたリポジトリを作成します"""
+    if STORAGE_BACKEND == 'log':
+        from data.log_store import LogThreadRepository
+        return LogThreadRepository(LOG_STORE_DIR)
+    return VolatileThreadRepository()
@@ -0,0 +1,251 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+
+from data.dynamodb_connection import get_dynamodb_client
+from data.message_schema import THREAD_METADATA_SORT_KEY
+
+# BatchWriteItemで1度に削除できるアイテム数の上限
+BATCH_SIZE = 25
+# 並列に実行するBatchWriteItemの数
+DELETION_PARALLELISM = int(os.getenv('DELETION_PARALLELISM', '4'))
+# 1バッチあたりの最大リトライ回数
+MAX_RETRIES = 10
+# リトライ時の待機時間（秒）の初期値と上限
+BACKOFF_BASE_SECONDS = 0.05
+BACKOFF_MAX_SECONDS = 5.0
+
+# スロットリングとして扱うエラーコード
+THROTTLING_ERRORS = (
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded'
+)
+
+# 削除要求を記録したスレッドのメタデータアイテムのみを含むスパースインデックス
+DELETION_INDEX = 'deletion-index'
+
+# 削除ジョブの状態
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+# テーブルに接続できず、メモリ上のデータのみを削除した
+STATUS_SKIPPED = 'skipped'
+
+
+class ThreadDeletionWorker:
+    """
+    スレッドの削除を非同期に行うクラス
+
+    削除要求を受けた時点でスレッドをtombstone（削除済み）として記録して読み取りから隠し、
+    `{env}-chat-messages` テーブルのメッセージはバックグラウンドで並列のBatchWriteItemにより削除します。
+    スロットリングされた場合はすべてのワーカーが指数バックオフで待機します。
+
+    削除要求はスレッドのメタデータアイテムにも記録し（deletion_status）、メタデータアイテムは
+    最後に削除します。削除の途中で再起動した場合は、記録が残っているスレッドの削除を再開できます。
+    """
+
+    def __init__(self, table_name: Optional[str] = None, parallelism: int = DELETION_PARALLELISM):
+        env = os.getenv('ENV', 'dev')
+        self.table_name = table_name or f"{env}-chat-messages"
+        self.parallelism = parallelism
+        self.jobs: Dict[int, Dict[str, Any]] = {}
+        self._pool = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='thread-deletion')
+        self._lock = threading.Lock()
+        # スロットリング中はこの時刻まですべてのワーカーが書き込みを控える
+        self._pause_until = 0.0
+
+    def tombstone(self, thread_id: int) -> Dict[str, Any]:
+        """
+        スレッドを削除済みとして記録します
+
+        Returns:
+            Dict: 削除ジョブの進捗
+        """
+        job = {
+            'threadId': thread_id,
+            'status': STATUS_PENDING,
+            'scannedItems': 0,
+            'deletedItems': 0,
+            'batches': 0,
+            'throttledRetries': 0,
+            'requestedAt': int(time.time() * 1000),
+            'finishedAt': None,
+            'error': None
+        }
+        self.jobs[thread_id] = job
+        return job
+
+    def record(self, thread_id: int) -> None:
+        """
+        削除要求をテーブルのスレッドのメタデータアイテムに記録します
+
+        テーブルに接続できない場合・書き込みに失敗した場合は記録せず、削除はこのプロセス内でのみ行います。
+        """
+        client = get_dynamodb_client()
+        if client is None:
+            return
+        try:
+            client.update_item(
+                TableName=self.table_name,
+                Key=self._metadata_key(thread_id),
+                UpdateExpression='SET deletion_status = :status, deletion_requested_at = :requested_at',
+                ExpressionAttributeValues={
+                    ':status': {'S': STATUS_PENDING},
+                    ':requested_at': {'N': str(self.jobs[thread_id]['requestedAt'])}
+                }
+            )
+        except Exception as e:
+            print(f"スレッド {thread_id} の削除要求を記録できませんでした: {e}")
+
+    def pending_thread_ids(self) -> List[int]:
+        """削除要求が記録され、削除が終わっていないスレッドのIDを返します（起動時の再開用）"""
+        client = get_dynamodb_client()
+        if client is None:
+            return []
+        thread_ids = []
+        try:
+            paginator = client.get_paginator('query')
+            pages = paginator.paginate(
+                TableName=self.table_name,
+                IndexName=DELETION_INDEX,
+                KeyConditionExpression='deletion_status = :status',
+                ExpressionAttributeValues={':status': {'S': STATUS_PENDING}}
+            )
+            for page in pages:
+                thread_ids.extend(int(item['thread_id']['S']) for item in page.get('Items', []))
+        except Exception as e:
+            print(f"削除中のスレッドを取得できませんでした: {e}")
+        return thread_ids
+
+    @staticmethod
+    def _metadata_key(thread_id: int) -> Dict[str, Any]:
+        return {'thread_id': {'S': str(thread_id)}, 'timestamp': {'S': THREAD_METADATA_SORT_KEY}}
+
+    def is_deleted(self, thread_id: int) -> bool:
+        """スレッドが削除済み（削除中を含む）かどうかを返します"""
+        return thread_id in self.jobs
+
+    def get_progress(self, thread_id: int) -> Optional[Dict[str, Any]]:
+        """削除ジョブの進捗を返します（削除要求がない場合はNone）"""
+        job = self.jobs.get(thread_id)
+        return dict(job) if job is not None else None
+
+    def _backoff(self, attempt: int) -> None:
+        """スロットリングされた場合に、すべてのワーカーの書き込みを一時停止します"""
+        delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)
+        with self._lock:
+            self._pause_until = max(self._pause_until, time.monotonic() + delay)
+
+    def _wait_for_pause(self) -> None:
+        remaining = self._pause_until - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def _delete_batch(self, client, job: Dict[str, Any], keys: List[Dict[str, Any]]) -> None:
+        """最大25件のアイテムをBatchWriteItemで削除します（未処理のアイテムはリトライ）"""
+        from botocore.exceptions import ClientError
+
+        requests = [{'DeleteRequest': {'Key': key}} for key in keys]
+        for attempt in range(MAX_RETRIES):
+            self._wait_for_pause()
+            try:
+                response = client.batch_write_item(RequestItems={self.table_name: requests})
+            except ClientError as e:
+                if e.response['Error']['Code'] not in THROTTLING_ERRORS:
+                    raise
+                with self._lock:
+                    job['throttledRetries'] += 1
+                self._backoff(attempt)
+                continue
+
+            unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            with self._lock:
+                job['deletedItems'] += len(requests) - len(unprocessed)
+                job['batches'] += 1
+            if not unprocessed:
+                return
+
+            # 未処理のアイテムはスロットリングされたものとして扱う
+            with self._lock:
+                job['throttledRetries'] += 1
+            self._backoff(attempt)
+            requests = unprocessed
+
+        raise RuntimeError(f"{len(requests)} items were not deleted after {MAX_RETRIES} retries")
+
+    def delete_items(self, thread_id: int) -> Dict[str, Any]:
+        """
+        スレッドのメッセージをテーブルから削除します（バックグラウンドのスレッドで実行）
+
+        Returns:
+            Dict: 削除ジョブの進捗
+        """
+        job = self.jobs[thread_id]
+        job['status'] = STATUS_RUNNING
+
+        client = get_dynamodb_client()
+        if client is None:
+            # テーブルに接続できない場合は、テーブルのメッセージを削除していないことを示す
+            job['status'] = STATUS_SKIPPED
+            job['finishedAt'] = int(time.time() * 1000)
+            return dict(job)
+
+        pending = set()
+        metadata_key = None
+        try:
+            paginator = client.get_paginator('query')
+            pages = paginator.paginate(
+                TableName=self.table_name,
+                KeyConditionExpression='thread_id = :thread_id',
+                ExpressionAttributeValues={':thread_id': {'S': str(thread_id)}},
+                ProjectionExpression='thread_id, #ts',
+                ExpressionAttributeNames={'#ts': 'timestamp'}
+            )
+
+            for page in pages:
+                keys = page.get('Items', [])
+                job['scannedItems'] += len(keys)
+                # 削除要求を記録したメタデータアイテムは、メッセージをすべて削除してから削除する
+                for key in keys:
+                    if key['timestamp']['S'] == THREAD_METADATA_SORT_KEY:
+                        metadata_key = key
+                keys = [key for key in keys if key is not metadata_key]
+                for i in range(0, len(keys), BATCH_SIZE):
+                    pending.add(self._pool.submit(self._delete_batch, client, job, keys[i:i + BATCH_SIZE]))
+
+                    # 実行待ちのバッチが増えすぎないよう、並列数の数倍までに抑える
+                    if len(pending) >= self.parallelism * 4:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+
+            if metadata_key is not None:
+                self._delete_batch(client, job, [metadata_key])
+            job['status'] = STATUS_COMPLETED
+        except Exception as e:
+            # 実行待ちのバッチを取り消し、実行中のバッチが終わってから失敗として記録する
+            for future in pending:
+                future.cancel()
+            wait(pending)
+            job['status'] = STATUS_FAILED
+            job['error'] = str(e)
+            print(f"スレッド {thread_id} のメッセージ削除中にエラーが発生しました: {e}")
+        finally:
+            job['finishedAt'] = int(time.time() * 1000)
+
+        print(f"スレッド {thread_id} の削除: status={job['status']}, 削除件数={job['deletedItems']}")
+        return dict(job)
+
+
+DELETIONS = ThreadDeletionWorker()
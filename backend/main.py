@@ -1,24 +1,57 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api import api_router
+from app.dependencies import ALLOWED_ORIGINS
+from app.routers.threads import TIERING, resume_deletions, start_repository, start_tiering, stop_repository
+from data.dynamodb_connection import warm_up_dynamodb
+from data.message_checkpoints import CHECKPOINTS
+import asyncio
 import logging
+import os
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Simple API", description="固定値を返すシンプルなAPI")
+# DynamoDBへの接続を準備するタイミング
+#   background: 起動後にバックグラウンドで接続する（デフォルト）
+#   lazy: 最初に使われた時点で接続する
+#   eager: 接続が完了するまで起動を待つ
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background").lower()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if STARTUP_MODE == "eager":
+        await asyncio.to_thread(warm_up_dynamodb)
+    elif STARTUP_MODE == "background":
+        # リクエストの受付を待たせないよう、boto3のimportと接続はバックグラウンドで行う
+        app.state.dynamodb_warm_up = asyncio.create_task(asyncio.to_thread(warm_up_dynamodb))
+    
+    # 前回のプロセスで書きかけになったメッセージを確定し、チェックポイントの書き込みを開始
+    await CHECKPOINTS.start(recover_now=STARTUP_MODE != "lazy")
+    # 保存されているスレッドを読み込めるようにする（ログ形式の場合はインデックスを復旧）
+    await start_repository()
+    # コールドストレージのインデックスを読み込み、スレッドの定期的な移動を開始
+    await start_tiering()
+    # 前回のプロセスで終わらなかったスレッドの削除を再開（テーブルへの接続を待たせないようバックグラウンドで行う）
+    if STARTUP_MODE != "lazy":
+        app.state.deletion_resume = asyncio.create_task(resume_deletions())
+    
+    yield
+    
+    await TIERING.stop()
+    # 書き込み待ちのスレッド・メッセージを永続化してから終了
+    await stop_repository()
+    # 未書き込みのチェックポイントを書き込んでから終了
+    await CHECKPOINTS.stop()
+
+
+app = FastAPI(title="Simple API", description="固定値を返すシンプルなAPI", lifespan=lifespan)
 
 # フロントエンドのオリジン
-origins = [
-    "http://localhost:5173",  # Viteのデフォルトポート
-    "http://127.0.0.1:5173",
-    "http://localhost:3000",  # Create React Appのデフォルトポート
-    "http://127.0.0.1:3000",
-    "http://localhost:8080",  # 他の一般的なフロントエンドポート
-    "http://127.0.0.1:8080",
-    # 必要に応じて追加
-]
+origins = ALLOWED_ORIGINS
 
 # CORSの設定
 app.add_middleware(
@@ -0,0 +1,90 @@
+"""
+クライアント切断時にストリーミング生成が停止することの確認
+"""
+import asyncio
+
+import pytest
+
+from app.generation import (
+    DISCONNECT_POLL_INTERVAL, STATUS_STREAMING, STATUS_TRUNCATED, STREAMS, generate_reply, stream_reply
+)
+from data.message_checkpoints import CHECKPOINTS
+
+
+class StubClient:
+    """is_disconnected() の結果を切り替えられるクライアント"""
+
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self) -> bool:
+        return self.disconnected
+
+
+@pytest.fixture(autouse=True)
+def disable_checkpoints(monkeypatch):
+    # テーブルへのチェックポイントの書き込みは行わない
+    monkeypatch.setattr(CHECKPOINTS, "_disabled", True)
+
+
+def _open_stream(message_id: int):
+    message = {"id": message_id, "text": "", "sender": "assistant", "timestamp": 0, "status": STATUS_STREAMING}
+    return STREAMS.open(1, message, "test_user")
+
+
+async def _wait_until_stopped(stream) -> float:
+    """上流の生成処理が停止するまで待ち、かかった時間（秒）を返します"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    while not stream.producer.done():
+        await asyncio.sleep(0.01)
+    return loop.time() - started
+
+
+def test_stream_stops_when_client_disconnects_between_chunks():
+    async def run():
+        client = StubClient()
+        stream = _open_stream(1001)
+        loop = asyncio.get_running_loop()
+
+        received = []
+        async for chunk in stream_reply(client, stream, generate_reply("x" * 1000, duration=100.0)):
+            received.append(chunk)
+            if len(received) == 3:
+                client.disconnected = True
+                disconnected_at = loop.time()
+
+        await asyncio.wait_for(_wait_until_stopped(stream), 2 * DISCONNECT_POLL_INTERVAL)
+        assert loop.time() - disconnected_at <= 2 * DISCONNECT_POLL_INTERVAL
+        return stream, received
+
+    stream, received = asyncio.run(run())
+    assert len(received) == 3
+    assert stream.producer.done()
+    assert stream.message["status"] == STATUS_TRUNCATED
+    assert len(stream.message["text"]) < 1000
+    assert STREAMS.active == {}
+
+
+def test_stream_stops_when_client_disconnects_while_upstream_is_idle():
+    async def run():
+        client = StubClient()
+        # 上流が次のチャンクを返すまで長時間かかる状態で切断する
+        stream = _open_stream(1002)
+        loop = asyncio.get_running_loop()
+
+        chunks = stream_reply(client, stream, generate_reply("xy", duration=100.0))
+        assert await chunks.__anext__() == "x"
+        client.disconnected = True
+        disconnected_at = loop.time()
+
+        with pytest.raises(StopAsyncIteration):
+            await chunks.__anext__()
+        await asyncio.wait_for(_wait_until_stopped(stream), 2 * DISCONNECT_POLL_INTERVAL)
+        assert loop.time() - disconnected_at <= 2 * DISCONNECT_POLL_INTERVAL
+        return stream
+
+    stream = asyncio.run(run())
+    assert stream.producer.done()
+    assert stream.message["status"] == STATUS_TRUNCATED
+    assert STREAMS.active == {}
@@ -0,0 +1,140 @@
+"""
+追記型ログストレージ（LogThreadRepository）の書き込みと復旧の確認
+"""
+import os
+
+import pytest
+
+from data.log_store import SNAPSHOT_FILE, LogThreadRepository, _segment_name
+
+
+def _open(directory, **kwargs) -> LogThreadRepository:
+    repository = LogThreadRepository(str(directory), fsync=False, **kwargs)
+    repository.open()
+    return repository
+
+
+def _message(message_id: int, text: str = "x" * 40):
+    return {"id": message_id, "text": text, "sender": "user", "timestamp": message_id}
+
+
+def _write_thread(repository: LogThreadRepository, thread_id: int, message_ids) -> None:
+    futures = [repository.save_thread({"id": thread_id, "title": f"thread {thread_id}", "createdAt": 0, "updatedAt": 0})]
+    futures += [repository.append_message(thread_id, _message(message_id)) for message_id in message_ids]
+    # 書き込みが永続化されるまで待つ
+    for future in futures:
+        future.result()
+
+
+def _message_ids(repository: LogThreadRepository, thread_id: int):
+    return [message["id"] for message in repository.load_thread(thread_id)["messages"]]
+
+
+def test_recovers_from_snapshot_and_log_tail(tmp_path):
+    # スレッド1の11レコードを書き込んだ時点でスナップショットを作成する
+    repository = _open(tmp_path, snapshot_records=11)
+    _write_thread(repository, 1, range(1, 11))
+    # スナップショット以降のレコードはログの末尾から復旧する
+    _write_thread(repository, 2, [11, 12])
+    assert repository.get_stats()["snapshots"] == 1
+
+    # 終了時のスナップショットを作らずに停止した状態から開き直す
+    recovered = _open(tmp_path, snapshot_records=11)
+    stats = recovered.get_stats()
+    assert stats["recoveredFromSnapshot"]
+    assert stats["replayedRecords"] == 3
+    assert _message_ids(recovered, 1) == list(range(1, 11))
+    assert _message_ids(recovered, 2) == [11, 12]
+    assert recovered.max_ids() == (2, 12)
+    recovered.close()
+    repository.close()
+
+
+def test_truncates_torn_tail(tmp_path):
+    repository = _open(tmp_path)
+    _write_thread(repository, 1, [1, 2, 3])
+    repository.close()
+    os.remove(tmp_path / SNAPSHOT_FILE)
+
+    # 書き込み途中で停止した末尾のレコードを再現する
+    path = tmp_path / _segment_name(1)
+    size = os.path.getsize(path)
+    with open(path, "r+b") as f:
+        f.truncate(size - 5)
+
+    recovered = _open(tmp_path)
+    assert recovered.get_stats()["truncatedBytes"] > 0
+    assert os.path.getsize(path) < size - 5
+    # 切り捨てたレコードの位置から書き込みを続けられる
+    recovered.append_message(1, _message(4)).result()
+    recovered.close()
+    os.remove(tmp_path / SNAPSHOT_FILE)
+
+    replayed = _open(tmp_path)
+    assert _message_ids(replayed, 1) == [1, 2, 4]
+    replayed.close()
+
+
+def test_rolls_over_segments(tmp_path):
+    repository = _open(tmp_path, segment_bytes=300)
+    _write_thread(repository, 1, range(1, 21))
+    assert repository.get_stats()["activeSegment"] > 1
+    assert _message_ids(repository, 1) == list(range(1, 21))
+    repository.close()
+
+    segments = sorted(name for name in os.listdir(tmp_path) if name.endswith(".log"))
+    assert len(segments) > 1
+    for name in segments[:-1]:
+        assert os.path.getsize(tmp_path / name) <= 300
+
+    os.remove(tmp_path / SNAPSHOT_FILE)
+    recovered = _open(tmp_path, segment_bytes=300)
+    assert _message_ids(recovered, 1) == list(range(1, 21))
+    recovered.close()
+
+
+@pytest.mark.parametrize("with_snapshot", [True, False])
+def test_replays_deletes(tmp_path, with_snapshot):
+    repository = _open(tmp_path)
+    _write_thread(repository, 1, [1, 2])
+    _write_thread(repository, 2, [3])
+    repository.delete_thread(1).result()
+    repository.close()
+    if not with_snapshot:
+        os.remove(tmp_path / SNAPSHOT_FILE)
+
+    recovered = _open(tmp_path)
+    assert not recovered.has_thread(1)
+    assert recovered.load_thread(1) is None
+    assert _message_ids(recovered, 2) == [3]
+    assert [t["id"] for t in recovered.list_thread_summaries()] == [2]
+    recovered.close()
+
+
+def test_failed_write_is_not_indexed(tmp_path):
+    repository = _open(tmp_path)
+    _write_thread(repository, 1, [1])
+
+    write = repository._write_placed
+    calls = []
+
+    def fail_once(placed):
+        calls.append(placed)
+        if len(calls) == 1:
+            # 途中まで書き込んでから失敗する
+            repository._file.write(placed[0][3][:5])
+            raise OSError(28, "No space left on device")
+        write(placed)
+
+    repository._write_placed = fail_once
+    with pytest.raises(OSError):
+        repository.append_message(1, _message(2)).result()
+    repository.append_message(1, _message(3)).result()
+    assert _message_ids(repository, 1) == [1, 3]
+    repository.close()
+
+    os.remove(tmp_path / SNAPSHOT_FILE)
+    recovered = _open(tmp_path)
+    assert recovered.get_stats()["truncatedBytes"] == 0
+    assert _message_ids(recovered, 1) == [1, 3]
+    recovered.close()
@@ -0,0 +1,91 @@
+"""
+WebSocketでの生成開始直後のキャンセル・切断でストリームスロットが解放されることの確認
+"""
+import asyncio
+import json
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+from app.generation import DISCONNECT_POLL_INTERVAL, STATUS_TRUNCATED, STREAMS
+from app.routers.threads import MOCK_THREADS
+from app.routers.ws import chat_socket
+from data.message_checkpoints import CHECKPOINTS
+
+THREAD_ID = 1
+
+
+class StubWebSocket:
+    """受信するフレームを順番に返し、送信したフレームを記録するWebSocket"""
+
+    def __init__(self, frames):
+        self.headers = {"origin": "http://localhost:5173"}
+        self.cookies = {"user_id": "1"}
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        for frame in frames:
+            self.incoming.put_nowait(frame)
+        self.sent = []
+
+    async def accept(self) -> None:
+        pass
+
+    async def receive_text(self) -> str:
+        frame = await self.incoming.get()
+        if frame is None:
+            raise WebSocketDisconnect()
+        return json.dumps(frame)
+
+    async def send_text(self, text: str) -> None:
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        pass
+
+
+@pytest.fixture(autouse=True)
+def disable_checkpoints(monkeypatch):
+    # テーブルへのチェックポイントの書き込みは行わない
+    monkeypatch.setattr(CHECKPOINTS, "_disabled", True)
+
+
+def _find_message(message_id: int):
+    thread = next(t for t in MOCK_THREADS if t["id"] == THREAD_ID)
+    return next(m for m in thread["messages"] if m["id"] == message_id)
+
+
+async def _wait_for_end_frame(websocket: StubWebSocket) -> None:
+    while not any(frame[0] == "e" for frame in websocket.sent):
+        await asyncio.sleep(0.01)
+
+
+def test_cancel_right_after_generate_releases_stream():
+    async def run():
+        websocket = StubWebSocket([["g", 1, "hello"], ["x", 2]])
+        socket = asyncio.create_task(chat_socket(websocket, THREAD_ID))
+        await asyncio.wait_for(_wait_for_end_frame(websocket), 2 * DISCONNECT_POLL_INTERVAL)
+        websocket.incoming.put_nowait(None)
+        await socket
+        return websocket
+
+    websocket = asyncio.run(run())
+    ack = websocket.sent[0]
+    assert ack[:2] == ["a", 1]
+    message_id = ack[2]
+
+    assert STREAMS.active == {}
+    assert _find_message(message_id)["status"] == STATUS_TRUNCATED
+    assert ["e", message_id, STATUS_TRUNCATED] in websocket.sent
+
+
+def test_disconnect_right_after_generate_releases_stream():
+    async def run():
+        websocket = StubWebSocket([["g", 1, "hello"], None])
+        await chat_socket(websocket, THREAD_ID)
+        await asyncio.sleep(0)
+        return websocket
+
+    websocket = asyncio.run(run())
+    message_id = websocket.sent[0][2]
+
+    assert STREAMS.active == {}
+    assert _find_message(message_id)["status"] == STATUS_TRUNCATED